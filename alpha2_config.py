@@ -96,6 +96,18 @@ class Alpha2Config:
         """獲取當前配置"""
         return cls.CURRENT.copy()
     
+    @classmethod
+    def get_fingerprint(cls):
+        """獲取當前配置的效果參數指紋（用於判斷快取的合成結果是否仍然有效）"""
+        config = cls.CURRENT
+        return (
+            config['base_alpha'],
+            config['highlight_factor'],
+            config['saturation_boost'],
+            config['overlay_intensity'],
+            config.get('overlay_count', 3)
+        )
+    
     @classmethod
     def set_config(cls, config_name):
         """設置配置"""
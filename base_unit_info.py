@@ -1,3 +1,7 @@
+import os
+import struct
+from collections import OrderedDict
+from datetime import datetime
 from PIL import Image, ImageDraw
 import numpy as np
 from util import Util
@@ -9,8 +13,167 @@ class BaseUnitInfo:
     FILL = 0x80
     FILL_REPEAT = 0xC0
     
-    def compress_unit_data(self, unit_data):
-        """壓縮單位數據"""
+    # 是否使用NumPy向量化的單元解壓（False時使用逐位元組的參考實作）
+    USE_VECTORIZED_DECODER = True
+    # 是否使用NumPy整體繪製位圖（False時使用逐像素draw.point的參考實作）
+    USE_VECTORIZED_RENDERER = True
+    # 是否使用直接寫入位元組緩衝區的壓縮（False時使用十六進制字串串接的參考實作）
+    USE_BINARY_ENCODER = True
+    # 是否預設使用最短輸出的動態規劃壓縮（含跳過模式）；False時輸出與十六進制字串版本逐位元組相同，
+    # 供效能測試比對，匯入位圖時一律使用動態規劃壓縮
+    USE_OPTIMAL_ENCODER = False
+    
+    # RGB555 -> RGBA 查找表（依alpha及透明色，首次使用時建立）
+    _rgb555_luts = {}
+    
+    # 各畫布尺寸的繪製索引快取（LRU）
+    DRAW_INDEX_CACHE_SIZE = 32
+    _draw_index_cache = OrderedDict()
+    
+    def compress_unit_data(self, unit_data, optimal=None):
+        """壓縮單位數據（直接寫入預先配置的位元組緩衝區，輸出與十六進制字串版本相同）
+        
+        optimal: 使用逐行動態規劃選擇最短的控制碼序列並輸出跳過模式，None時依USE_OPTIMAL_ENCODER
+        """
+        MAX_COUNTER = 0x1E
+        
+        if optimal is None:
+            optimal = self.USE_OPTIMAL_ENCODER
+        
+        if not (self.USE_BINARY_ENCODER or optimal) or len(unit_data) % 2:
+            return self._compress_unit_data_hex(unit_data)
+        
+        data = bytes(unit_data)
+        # 填充模式以 get_le_int16 讀取後按大端序輸出，即每個像素的兩個位元組互換
+        swapped = bytearray(len(data))
+        swapped[0::2] = data[1::2]
+        swapped[1::2] = data[0::2]
+        words = memoryview(data).cast('H').tolist()
+        
+        # 每個像素最多佔用 1 個控制位元組 + 2 個像素位元組
+        out = bytearray(len(words) * 3)
+        pos = 0
+        for start in range(0, len(words), MAX_COUNTER):
+            end = min(start + MAX_COUNTER, len(words))
+            if optimal:
+                pos = self._compress_block_optimal_into(words, swapped, start, end, out, pos)
+            else:
+                pos = self._compress_block_into(words, data, swapped, start, end, out, pos)
+        
+        return bytes(out[:pos])
+    
+    def _compress_block_optimal_into(self, words, swapped, start, end, out, pos):
+        """以動態規劃壓縮一行像素，選擇位元組數最少的控制碼序列並寫入out，返回新的寫入位置
+        
+        各模式的成本：跳過 1 位元組（僅限透明色0，解壓時保持為0）、
+        重複 3 位元組、填充 1 + 2n 位元組；每個控制碼最多表示 0x20 個像素。
+        """
+        MAX_RUN = 0x20
+        INFINITE = float('inf')
+        n = end - start
+        
+        # cost[i]：壓縮第i個像素到行尾所需的最少位元組數
+        cost = [0] * (n + 1)
+        # fill_cost[i]：min(2k + cost[i+k])，即從i開始填充k個像素的最佳接續
+        fill_cost = [INFINITE] * (n + 1)
+        fill_len = [0] * (n + 1)
+        # run_cost[i]：min(cost[i+k])，k不超過從i開始相同顏色的長度
+        run_cost = [INFINITE] * (n + 1)
+        run_len = [0] * (n + 1)
+        choice_head = [0] * n
+        choice_len = [0] * n
+        
+        for i in range(n - 1, -1, -1):
+            color = words[start + i]
+            
+            # 填充模式
+            if fill_cost[i + 1] < cost[i + 1] and fill_len[i + 1] < MAX_RUN:
+                fill_cost[i] = 2 + fill_cost[i + 1]
+                fill_len[i] = fill_len[i + 1] + 1
+            else:
+                fill_cost[i] = 2 + cost[i + 1]
+                fill_len[i] = 1
+            best = 1 + fill_cost[i]
+            head = BaseUnitInfo.FILL
+            length = fill_len[i]
+            
+            # 重複模式或跳過模式
+            if (i + 1 < n and words[start + i + 1] == color and
+                    run_cost[i + 1] < cost[i + 1] and run_len[i + 1] < MAX_RUN):
+                run_cost[i] = run_cost[i + 1]
+                run_len[i] = run_len[i + 1] + 1
+            else:
+                run_cost[i] = cost[i + 1]
+                run_len[i] = 1
+            
+            if color == 0:
+                run_total = 1 + run_cost[i]
+                run_head = BaseUnitInfo.SKIP
+            else:
+                run_total = 3 + run_cost[i]
+                run_head = BaseUnitInfo.FILL_REPEAT
+            
+            if run_total <= best:
+                best = run_total
+                head = run_head
+                length = run_len[i]
+            
+            cost[i] = best
+            choice_head[i] = head
+            choice_len[i] = length
+        
+        i = 0
+        while i < n:
+            head = choice_head[i]
+            length = choice_len[i]
+            out[pos] = head | (length - 1)
+            pos += 1
+            
+            p = (start + i) * 2
+            if head == BaseUnitInfo.FILL:
+                out[pos:pos + length * 2] = swapped[p:p + length * 2]
+                pos += length * 2
+            elif head == BaseUnitInfo.FILL_REPEAT:
+                out[pos:pos + 2] = swapped[p:p + 2]
+                pos += 2
+            i += length
+        
+        return pos
+    
+    def _compress_block_into(self, words, data, swapped, start, end, out, pos):
+        """壓縮一個區塊（像素範圍 start ~ end）並寫入out，返回新的寫入位置"""
+        i = start
+        
+        while i < end:
+            color = words[i]
+            
+            # 尋找重複模式
+            n = 1
+            while i + n < end and n < 0x1F and words[i + n] == color:
+                n += 1
+            
+            if n > 1:
+                head = BaseUnitInfo.FILL_REPEAT
+            else:
+                # 尋找填充模式
+                while i + n < end and n < 0x1F and words[i + n] != color:
+                    n += 1
+                head = BaseUnitInfo.FILL
+            
+            if n > 1:
+                out[pos] = head | (n - 1)
+                out[pos + 1:pos + 1 + n * 2] = swapped[i * 2:(i + n) * 2]
+                pos += 1 + n * 2
+            else:
+                # 單個像素
+                out[pos:pos + 2] = data[i * 2:i * 2 + 2]
+                pos += 2
+            i += n
+        
+        return pos
+    
+    def _compress_unit_data_hex(self, unit_data):
+        """以十六進制字串串接壓縮單位數據（參考實作）"""
         MAX_COUNTER = 0x1E
         ret_str = ""
         
@@ -40,6 +203,81 @@ class BaseUnitInfo:
     
     def get_draw_data(self, unit_data):
         """獲取繪製數據"""
+        if not self.USE_VECTORIZED_DECODER:
+            return self._get_draw_data_reference(unit_data)
+        
+        draw_array = self.decode_unit_array(unit_data)
+        if draw_array is None:
+            return self._get_draw_data_reference(unit_data)
+        return draw_array.tobytes()
+    
+    def decode_unit_array(self, unit_data):
+        """將單元數據解壓為RGB555 (uint16) 陣列，數據格式異常時返回None"""
+        runs = self._scan_draw_runs(unit_data)
+        if runs is None:
+            return None
+        
+        ret = np.zeros(BaseUnitInfo.BLOCK_X_LIMIT * BaseUnitInfo.BLOCK_Y_LIMIT, dtype='<u2')
+        dst, src, count, repeat = runs
+        if not count:
+            return ret
+        
+        # 將每個執行段展開為逐像素的目標/來源索引
+        dst = np.array(dst, dtype=np.intp)
+        src = np.array(src, dtype=np.intp)
+        count = np.array(count, dtype=np.intp)
+        step = np.where(repeat, 0, 2)
+        
+        run_id = np.repeat(np.arange(len(count)), count)
+        run_begin = np.cumsum(count) - count
+        within = np.arange(run_id.size) - run_begin[run_id]
+        
+        dst_index = dst[run_id] + within
+        src_index = src[run_id] + within * step[run_id]
+        
+        raw = np.frombuffer(unit_data, dtype=np.uint8)
+        ret[dst_index] = raw[src_index] | (raw[src_index + 1].astype(np.uint16) << 8)
+        return ret
+    
+    def _scan_draw_runs(self, unit_data):
+        """掃描控制位元組，產生執行段描述 (目標像素, 來源位元組, 像素數, 是否重複)"""
+        pixel_limit = BaseUnitInfo.BLOCK_X_LIMIT * BaseUnitInfo.BLOCK_Y_LIMIT
+        size = len(unit_data)
+        dst = []
+        src = []
+        count = []
+        repeat = []
+        p = 0
+        j = 0
+        
+        while j < size:
+            head = unit_data[j]
+            n = (head & 0x1F) + 1
+            
+            if (head & 0x80) == 0x80:
+                is_repeat = (head & 0x40) == 0x40
+                length = 2 if is_repeat else n * 2
+                if j + 1 + length > size:
+                    return None
+                
+                # 重複模式只讀取一個像素，填充模式讀取n個像素
+                dst.append(p)
+                src.append(j + 1)
+                count.append(n)
+                repeat.append(is_repeat)
+                j += length
+            # 跳過模式及未使用的情況只移動輸出位置
+            p += n
+            j += 1
+        
+        # 超出單元範圍時交由參考實作處理，以保持完全一致的輸出
+        if p > pixel_limit:
+            return None
+        
+        return dst, src, count, repeat
+    
+    def _get_draw_data_reference(self, unit_data):
+        """逐個控制位元組解壓單元數據（參考實作）"""
         ret = bytearray(BaseUnitInfo.BLOCK_X_LIMIT * BaseUnitInfo.BLOCK_Y_LIMIT * 2)
         p = 0
         j = 0
@@ -71,8 +309,153 @@ class BaseUnitInfo:
         
         return bytes(ret)
     
-    def make_bitmap(self, draw_data, x, y, alpha_flag=0, red=0, green=0, blue=0, is_transparent=False):
-        """創建位圖"""
+    def make_bitmap(self, draw_data, x, y, alpha_flag=0, red=0, green=0, blue=0, is_transparent=False, color_key=None):
+        """創建位圖
+        
+        color_key: 在RGB555轉換時即設為透明的顏色（例如 (0, 0, 0)），不需額外處理整張圖像
+        """
+        if not self.USE_VECTORIZED_RENDERER:
+            image = self._make_bitmap_reference(draw_data, x, y, alpha_flag, red, green, blue, is_transparent)
+            return image if color_key is None else self.make_color_transparent(image, color_key)
+        
+        # 設定透明色（與C#版本一致）
+        if color_key is None and is_transparent:
+            if alpha_flag == 0x02:
+                color_key = (0, 0, 0)  # 黑色
+            elif alpha_flag == 0x07:
+                color_key = (255, 255, 255)  # 白色
+        
+        # 處理透明度（與C#版本一致）
+        alpha = 128 if alpha_flag == 0x01 else 255
+        
+        if isinstance(draw_data, np.ndarray):
+            colors = draw_data
+        else:
+            colors = np.frombuffer(draw_data, dtype='<u2', count=len(draw_data) // 2)
+        
+        block_x = x // BaseUnitInfo.BLOCK_X_LIMIT
+        if x <= 0 or y <= 0 or block_x == 0 or colors.size == 0:
+            return Image.new('RGBA', (max(x, 0), max(y, 0)), (0, 0, 0, 0))
+        
+        # 透過查找表一次轉換所有RGB555像素（透明色已套用在查找表中）
+        rgba = self.get_rgb555_lut(alpha, color_key)[colors & 0x7FFF]
+        canvas = self._scatter_draw_pixels(rgba, x, y)
+        
+        return Image.frombuffer('RGBA', (x, y), canvas, 'raw', 'RGBA', 0, 1)
+    
+    @classmethod
+    def get_rgb555_lut(cls, alpha=255, color_key=None):
+        """獲取32768項的RGB555 -> RGBA查找表（依alpha及透明色快取）"""
+        key = (alpha, None if color_key is None else tuple(color_key))
+        lut = BaseUnitInfo._rgb555_luts.get(key)
+        if lut is not None:
+            return lut
+        
+        color = np.arange(0x8000, dtype=np.uint16)
+        lut = np.empty((0x8000, 4), dtype=np.uint8)
+        lut[:, 0] = (color & 0x7C00) >> 7
+        lut[:, 1] = (color & 0x03E0) >> 2
+        lut[:, 2] = (color & 0x001F) << 3
+        lut[:, 3] = alpha
+        if color_key is not None:
+            cls.apply_color_key(lut, color_key)
+        
+        lut.flags.writeable = False
+        BaseUnitInfo._rgb555_luts[key] = lut
+        return lut
+    
+    @staticmethod
+    def convert_to_rgb555(pixels, dtype='>u2'):
+        """將 (..., RGB[A]) 陣列一次轉換為15-bit RGB555（預設大端序）"""
+        r = pixels[..., 0].astype(np.uint16)
+        g = pixels[..., 1].astype(np.uint16)
+        b = pixels[..., 2].astype(np.uint16)
+        color = ((r & 0xF8) << 7) | ((g & 0xF8) << 2) | ((b & 0xF8) >> 3)
+        return color.astype(dtype)
+    
+    @staticmethod
+    def apply_color_key(pixels, key_color=(0, 0, 0), alpha_condition=None):
+        """將RGBA陣列中符合透明色的像素alpha設為0（就地修改），返回被修改的遮罩
+        
+        alpha_condition: 只處理alpha等於此值的像素，None表示不限
+        """
+        key = np.all(pixels[..., :3] == key_color, axis=-1)
+        if alpha_condition is not None:
+            key &= pixels[..., 3] == alpha_condition
+        pixels[key, 3] = 0
+        return key
+    
+    @classmethod
+    def make_color_transparent(cls, image, key_color=(0, 0, 0), alpha_condition=None):
+        """將圖像中符合透明色的像素變為透明，沒有符合的像素時直接返回原圖像"""
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        
+        pixels = np.asarray(image)
+        key = np.all(pixels[..., :3] == key_color, axis=-1) & (pixels[..., 3] != 0)
+        if alpha_condition is not None:
+            key &= pixels[..., 3] == alpha_condition
+        if not key.any():
+            return image
+        
+        pixels = pixels.copy()
+        pixels[key, 3] = 0
+        return Image.fromarray(pixels, 'RGBA')
+    
+    @classmethod
+    def get_draw_index(cls, x_limit, y_limit):
+        """獲取 (x_limit, y_limit) 畫布的繪製索引：繪製緩衝區第k個像素 -> 光柵位置
+        
+        超出畫布的像素對應到哨兵位置 x_limit * y_limit。
+        """
+        key = (x_limit, y_limit)
+        cache = BaseUnitInfo._draw_index_cache
+        index = cache.get(key)
+        if index is not None:
+            cache.move_to_end(key)
+            return index
+        
+        block_size = BaseUnitInfo.BLOCK_X_LIMIT * BaseUnitInfo.BLOCK_Y_LIMIT
+        block_x = x_limit // BaseUnitInfo.BLOCK_X_LIMIT
+        block_y = -(-y_limit // BaseUnitInfo.BLOCK_Y_LIMIT)
+        
+        # 與get_draw_coordinate相同的區塊/行運算，一次計算所有偏移
+        point_count = np.arange(block_x * block_y * block_size, dtype=np.intp)
+        total_line = point_count // BaseUnitInfo.BLOCK_X_LIMIT
+        total_block = total_line // BaseUnitInfo.BLOCK_Y_LIMIT
+        x = point_count % BaseUnitInfo.BLOCK_X_LIMIT + (total_block % block_x) * BaseUnitInfo.BLOCK_X_LIMIT
+        y = total_line % BaseUnitInfo.BLOCK_Y_LIMIT + (total_block // block_x) * BaseUnitInfo.BLOCK_Y_LIMIT
+        
+        index = np.where(y < y_limit, y * x_limit + x, x_limit * y_limit)
+        index.flags.writeable = False
+        
+        cache[key] = index
+        while len(cache) > cls.DRAW_INDEX_CACHE_SIZE:
+            cache.popitem(last=False)
+        return index
+    
+    @classmethod
+    def _scatter_draw_pixels(cls, pixels, x_limit, y_limit):
+        """將繪製緩衝區順序的像素一次散佈到 (y, x, 通道) 的光柵畫布"""
+        index = cls.get_draw_index(x_limit, y_limit)
+        count = min(len(pixels), len(index))
+        
+        # 多配置一個哨兵像素承接畫布外的數據
+        flat = np.zeros((x_limit * y_limit + 1,) + pixels.shape[1:], dtype=pixels.dtype)
+        flat[index[:count]] = pixels[:count]
+        return flat[:-1].reshape((y_limit, x_limit) + pixels.shape[1:])
+    
+    @classmethod
+    def _gather_draw_pixels(cls, raster, x_limit, y_limit):
+        """將 (y, x, ...) 光柵畫布一次收集為繪製緩衝區順序（_scatter_draw_pixels的逆運算）"""
+        index = cls.get_draw_index(x_limit, y_limit)
+        flat = raster.reshape((x_limit * y_limit,) + raster.shape[2:])
+        padded = np.zeros((len(flat) + 1,) + flat.shape[1:], dtype=flat.dtype)
+        padded[:-1] = flat
+        return padded[index]
+    
+    def _make_bitmap_reference(self, draw_data, x, y, alpha_flag=0, red=0, green=0, blue=0, is_transparent=False):
+        """逐像素繪製位圖（參考實作）"""
         image = Image.new('RGBA', (x, y), (0, 0, 0, 0))
         draw = ImageDraw.Draw(image)
         
@@ -205,4 +588,78 @@ class BaseUnitInfo:
             ret += f"{block_data[i]:02x}{block_data[i+1]:02x}"
             i += 2
         
-        return ret 
\ No newline at end of file
+        return ret
+    
+    # 原地修補日誌備份的檔頭
+    JOURNAL_MAGIC = b'JRNL'
+    
+    def _patch_file_in_place(self, file_path, patches, journal_file):
+        """原地修補檔案的指定區段，修補前先將被覆蓋的原始內容寫入日誌備份
+        
+        patches: [(位置, 新數據)]，新數據不可超出原檔案範圍
+        """
+        with open(file_path, 'r+b') as f:
+            with open(journal_file, 'wb') as journal:
+                journal.write(self.JOURNAL_MAGIC)
+                for offset, data in patches:
+                    f.seek(offset)
+                    journal.write(struct.pack('<II', offset, len(data)))
+                    journal.write(f.read(len(data)))
+            
+            for offset, data in patches:
+                f.seek(offset)
+                f.write(data)
+    
+    @classmethod
+    def restore_journal_backup(cls, journal_file, target_file):
+        """以日誌備份將原地修補過的檔案還原為修補前的內容"""
+        with open(journal_file, 'rb') as journal:
+            journal_data = journal.read()
+        if journal_data[:len(cls.JOURNAL_MAGIC)] != cls.JOURNAL_MAGIC:
+            raise ValueError(f"無效的日誌備份: {journal_file}")
+        
+        with open(target_file, 'r+b') as f:
+            p = len(cls.JOURNAL_MAGIC)
+            while p + 8 <= len(journal_data):
+                offset, length = struct.unpack_from('<II', journal_data, p)
+                p += 8
+                f.seek(offset)
+                f.write(journal_data[p:p + length])
+                p += length
+    
+    def _create_backup_file(self, original_file, extension):
+        """創建備份檔案"""
+        now = datetime.now()
+        timestamp = now.strftime("%Y%m%d%H%M%S")
+        backup_name = f"{os.path.splitext(original_file)[0]}_Bak_{timestamp}{extension}"
+        return backup_name
+    
+    def _replace_file(self, file_path, file_data, backup_file, before_replace=None):
+        """將數據寫入暫存檔，原檔案改名為備份（不需複製整個檔案），再以暫存檔取代
+        
+        file_data: 位元組數據，或接收檔案物件並以串流寫入數據的函數
+        before_replace: 暫存檔寫入完成、取代原檔案之前呼叫（例如解除原檔案的記憶體映射）
+        """
+        temp_file = file_path + ".tmp"
+        try:
+            with open(temp_file, 'wb', buffering=1024 * 1024) as f:
+                if callable(file_data):
+                    file_data(f)
+                else:
+                    f.write(file_data)
+        except Exception:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+        
+        if before_replace is not None:
+            before_replace()
+        try:
+            if os.path.exists(file_path):
+                os.replace(file_path, backup_file)
+            os.replace(temp_file, file_path)
+        except Exception:
+            # 取代失敗時還原原檔案
+            if not os.path.exists(file_path) and os.path.exists(backup_file):
+                os.replace(backup_file, file_path)
+            raise
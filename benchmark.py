@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SAF編輯器效能測試腳本
+比較新舊實作的處理速度，並確認輸出結果一致
+"""
+
+import sys
+import os
+import time
+import random
+
+# 添加當前目錄到Python路徑
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from base_unit_info import BaseUnitInfo
+from util import Util
+
+def make_test_units(count, seed=0):
+    """創建測試用的單元數據（大端序RGB555，含重複及漸變區段）"""
+    rng = random.Random(seed)
+    unit_pixels = BaseUnitInfo.BLOCK_X_LIMIT * BaseUnitInfo.BLOCK_Y_LIMIT
+    units = []
+    
+    for _ in range(count):
+        words = []
+        while len(words) < unit_pixels:
+            # 十六進制字串版本無法處理以小端序讀取為負數的像素，測試數據避開這種情況
+            color = rng.randrange(0x8000) & 0xFF7F
+            words.extend([color] * rng.choice([1, 1, 2, 4, 12]))
+        units.append(b''.join(color.to_bytes(2, 'big') for color in words[:unit_pixels]))
+    
+    return units
+
+def measure(func, items, repeat=3):
+    """測量處理所有項目的最佳耗時（秒）"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_encoder(unit_count=500):
+    """比較位元組緩衝區壓縮與十六進制字串壓縮"""
+    print("=== 單元壓縮效能測試 ===")
+    
+    base_info = BaseUnitInfo()
+    units = make_test_units(unit_count)
+    total_bytes = sum(len(unit) for unit in units)
+    
+    # 確認輸出一致
+    for unit in units:
+        if base_info.compress_unit_data(unit) != base_info._compress_unit_data_hex(unit):
+            raise AssertionError("位元組緩衝區壓縮與十六進制字串壓縮的輸出不一致")
+    
+    hex_time = measure(base_info._compress_unit_data_hex, units)
+    binary_time = measure(base_info.compress_unit_data, units)
+    
+    print(f"  測試單元數：{unit_count} ({total_bytes / 1024:.1f} KB)")
+    print(f"  十六進制字串：{hex_time * 1000:.1f} ms ({total_bytes / hex_time / 1024 / 1024:.2f} MB/s)")
+    print(f"  位元組緩衝區：{binary_time * 1000:.1f} ms ({total_bytes / binary_time / 1024 / 1024:.2f} MB/s)")
+    print(f"  加速倍數：{hex_time / binary_time:.2f}x")
+
+def bench_readers(entry_count=100000, repeat=5):
+    """比較逐一讀取整數與批次讀取（偏移表、MPL索引及幀參數記錄）"""
+    print("\n=== 二進位讀取效能測試 ===")
+    
+    rng = random.Random(1)
+    table = bytes(rng.randrange(256) for _ in range(entry_count * 4))
+    
+    def read_scalar_int32(data):
+        return [Util.get_le_int32(data, p) for p in range(0, entry_count * 4, 4)]
+    
+    def read_bulk_int32(data):
+        return Util.get_le_ints(data, 0, entry_count, 4, signed=False)
+    
+    def read_scalar_int16(data):
+        return [Util.get_le_int16(data, p) for p in range(0, entry_count * 2, 2)]
+    
+    def read_array_int16(data):
+        return Util.get_typed_array(data, 0, entry_count, '<i2').astype('int16')
+    
+    def read_scalar_records(data):
+        records = []
+        for p in range(0, len(data) - 12, 13):
+            records.append((Util.get_le_int16(data, p), Util.get_le_int16(data, p + 2),
+                            Util.get_le_int16(data, p + 4), data[p + 6], Util.get_le_int16(data, p + 7),
+                            Util.get_le_int16(data, p + 9), Util.get_le_int16(data, p + 11)))
+        return records
+    
+    def read_iter_records(data):
+        return list(Util.iter_records(data, 0, '<hhhBhhh'))
+    
+    # 確認輸出一致
+    if list(read_bulk_int32(table)) != read_scalar_int32(table):
+        raise AssertionError("批次讀取32位整數的結果不一致")
+    if read_array_int16(table).tolist() != read_scalar_int16(table):
+        raise AssertionError("陣列讀取16位整數的結果不一致")
+    if read_iter_records(table) != read_scalar_records(table):
+        raise AssertionError("記錄讀取的結果不一致")
+    
+    cases = [
+        ("32位偏移表", read_scalar_int32, read_bulk_int32, "get_le_ints"),
+        ("16位MPL索引", read_scalar_int16, read_array_int16, "get_typed_array"),
+        ("13字節幀參數記錄", read_scalar_records, read_iter_records, "iter_records")
+    ]
+    
+    print(f"  測試數據：{len(table) / 1024:.1f} KB")
+    for name, scalar_func, bulk_func, bulk_name in cases:
+        scalar_time = measure(scalar_func, [table], repeat)
+        bulk_time = measure(bulk_func, [table], repeat)
+        print(f"  {name}：逐一讀取 {scalar_time * 1000:.2f} ms，{bulk_name} {bulk_time * 1000:.2f} ms，"
+              f"加速 {scalar_time / bulk_time:.1f}x")
+
+def check_frame_import(saf_file):
+    """確認把每一幀的合成位圖原樣匯入時不會重新壓縮任何單元"""
+    from saf_info import SAFInfo
+    
+    print("\n=== 幀匯入檢查 ===")
+    
+    saf_info = SAFInfo(saf_file)
+    try:
+        frame_count = 0
+        for frame_index in range(len(saf_info.frame_parameter)):
+            bitmap = saf_info.get_frame_bitmap(frame_index)
+            if bitmap is None:
+                continue
+            if saf_info.save_bitmap_to_frame(bitmap, frame_index) != 0:
+                raise AssertionError(f"幀 {frame_index} 未修改的位圖匯入後重新壓縮了單元")
+            frame_count += 1
+        
+        if saf_info._modified_chunks:
+            raise AssertionError("未修改的位圖匯入後標記了已修改的Chunk")
+        
+        print(f"  {frame_count} 幀未修改的位圖匯入後沒有重新壓縮任何單元")
+    finally:
+        saf_info.dispose()
+
+def main():
+    """主測試函數（可指定SAF檔案以檢查幀匯入）"""
+    print("SAF編輯器 - 效能測試")
+    print("=" * 50)
+    
+    bench_encoder()
+    bench_readers()
+    if len(sys.argv) > 1:
+        check_frame_import(sys.argv[1])
+    
+    print("=" * 50)
+    return True
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
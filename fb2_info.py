@@ -1,17 +1,34 @@
 import os
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from PIL import Image
+import numpy as np
 from base_unit_info import BaseUnitInfo
 from util import Util
+from mapped_file import MappedFile, ChunkItem
 
-class UnitData:
+class UnitData(ChunkItem):
     """單位數據"""
-    def __init__(self):
-        self.data = b''
+
+def _compress_tile_chunk(tile_chunk, optimal):
+    """在工作行程中壓縮一組區塊數據（模組層級函數，供行程池序列化呼叫）"""
+    encoder = BaseUnitInfo()
+    return [encoder.compress_unit_data(tile_data, optimal) for tile_data in tile_chunk]
 
 class FB2Info(BaseUnitInfo):
     """FB2檔案信息類"""
     
+    # 平行壓縮設定：工作行程數（None為CPU核心數）、每批區塊數、啟用平行壓縮的最少區塊數
+    PARALLEL_WORKERS = None
+    PARALLEL_CHUNK_SIZE = 64
+    PARALLEL_MIN_TILES = 512
+    
+    # 是否以記憶體映射延遲載入單元數據（False時一次讀入整個檔案並複製每個單元）
+    USE_LAZY_LOADER = True
+    
+    # 是否使用增量保存：單元大小未變時只原地修補變更的單元及MPL索引（False時總是完整重寫）
+    USE_INCREMENTAL_SAVE = True
+    
     def __init__(self, file_name):
         super().__init__()
         self.fb2_file = file_name
@@ -21,13 +38,23 @@ class FB2Info(BaseUnitInfo):
         self.map_y = 0
         self.unit_count = 0
         self.unit_data_set = []
-        self.unit_index = []
+        # MPL單元索引（int16陣列，依地圖區塊列優先排列）
+        self.unit_index = np.zeros(0, dtype=np.int16)
         
         # FB2檔案標頭
         self.fb2_head = bytes([0x43, 0x45, 0x4C, 0xD0, 0x07, 0x0F, 0x00, 0x1e, 0x00, 0x18, 0x00, 0x00, 0x00, 0x10, 0x00])
         # MPL檔案標頭
         self.mpl_head = bytes([0x4D, 0x50, 0x4C, 0xD0, 0x07, 0x0B, 0x00, 0x00, 0x00, 0x00, 0x00])
         
+        # 記憶體映射的FB2檔案（延遲載入時各單元數據引用其中的範圍）
+        self._mapped = None
+        
+        # 磁碟上檔案的現況，供增量保存比對：各單元的(位置, 長度)及數據、FB2檔案大小、MPL索引
+        self._saved_unit_layout = []
+        self._saved_unit_data = []
+        self._saved_fb2_size = 0
+        self._saved_unit_index = None
+        
         self._load_fb2_file(file_name)
     
     def _load_fb2_file(self, file_name):
@@ -36,6 +63,15 @@ class FB2Info(BaseUnitInfo):
         self._load_mpl_file()
         
         # 載入FB2檔案
+        if self.USE_LAZY_LOADER:
+            self._mapped = MappedFile(file_name)
+            try:
+                self._parse_fb2_structure_mapped(self._mapped)
+            except Exception:
+                self._unmap_fb2_file()
+                raise
+            return
+        
         with open(file_name, 'rb') as f:
             data = f.read()
         
@@ -58,25 +94,21 @@ class FB2Info(BaseUnitInfo):
         
         # 嘗試不同的地圖尺寸讀取位置
         # 方法1：原始位置（位址 7 和 9）
-        map_x_1 = Util.get_be_int16(data, 7)
-        map_y_1 = Util.get_be_int16(data, 9)
+        map_x_1, map_y_1 = Util.get_be_ints(data, 7, 2)
         print(f"DEBUG: 方法1 (位址7,9): {map_x_1} x {map_y_1}")
         
         # 方法2：嘗試位址 8 和 10
         if len(data) >= 12:
-            map_x_2 = Util.get_be_int16(data, 8)
-            map_y_2 = Util.get_be_int16(data, 10)
+            map_x_2, map_y_2 = Util.get_be_ints(data, 8, 2)
             print(f"DEBUG: 方法2 (位址8,10): {map_x_2} x {map_y_2}")
         
         # 方法3：嘗試小端序
-        map_x_3 = Util.get_le_int16(data, 7)
-        map_y_3 = Util.get_le_int16(data, 9)
+        map_x_3, map_y_3 = Util.get_le_ints(data, 7, 2)
         print(f"DEBUG: 方法3 (小端序位址7,9): {map_x_3} x {map_y_3}")
         
         # 方法4：嘗試位址 6 和 8
         if len(data) >= 10:
-            map_x_4 = Util.get_be_int16(data, 6)
-            map_y_4 = Util.get_be_int16(data, 8)
+            map_x_4, map_y_4 = Util.get_be_ints(data, 6, 2)
             print(f"DEBUG: 方法4 (位址6,8): {map_x_4} x {map_y_4}")
         
         # 暫時使用方法3（小端序）作為測試
@@ -104,15 +136,12 @@ class FB2Info(BaseUnitInfo):
         if len(data) < required_size:
             raise ValueError(f"MPL檔案數據不足: 需要 {required_size} bytes，實際 {len(data)} bytes")
         
-        # 解析單位索引
-        self.unit_index = []
-        p = 0x0B
-        for i in range(unit_count):
-            self.unit_index.append(Util.get_le_int16(data, p))
-            p += 2
+        # 一次解析所有單位索引
+        self.unit_index = Util.get_typed_array(data, 0x0B, unit_count, '<i2').astype(np.int16)
+        self._saved_unit_index = self.unit_index.copy()
     
-    def _parse_fb2_structure(self, data):
-        """解析FB2檔案結構"""
+    def _read_fb2_unit_layout(self, data):
+        """檢查FB2標頭、單位數量及偏移表，返回各單元在檔案中的位置 [(偏移, 長度)]（兩種載入方式共用）"""
         # 檢查檔案大小是否足夠
         if len(data) < 0x0F:  # 至少需要標頭 + 單位數量
             raise ValueError(f"FB2檔案太小: {len(data)} bytes")
@@ -135,53 +164,108 @@ class FB2Info(BaseUnitInfo):
         if len(data) < offset_table_size:
             raise ValueError(f"FB2檔案偏移表數據不足: 需要 {offset_table_size} bytes，實際 {len(data)} bytes")
         
-        # 解析單位數據
-        p = 0x0F
-        for i in range(self.unit_count):
+        # 一次讀取整個偏移表，最後一個單位到檔案結尾為止
+        offsets = Util.get_typed_array(data, 0x0F, self.unit_count, '<u4').astype(np.int64)
+        ends = np.append(offsets[1:], len(data))
+        
+        # 檢查偏移是否有效
+        invalid = (offsets >= len(data)) | (ends > len(data)) | (offsets >= ends)
+        if np.any(invalid):
+            i = int(np.argmax(invalid))
             if i == self.unit_count - 1:
-                # 最後一個單位
-                offset = Util.get_le_int32(data, p)
-                
-                # 檢查偏移是否有效
-                if offset < 0 or offset >= len(data):
-                    raise ValueError(f"無效的單位數據偏移: {offset}")
-                
-                unit_data = UnitData()
-                unit_data.data = self.get_sub_array(data, offset, len(data) - offset)
-                self.unit_data_set.append(unit_data)
-            else:
-                # 其他單位
-                offset = Util.get_le_int32(data, p)
-                offset1 = Util.get_le_int32(data, p + 4)
-                
-                # 檢查偏移是否有效
-                if offset < 0 or offset1 < 0 or offset >= len(data) or offset1 > len(data) or offset >= offset1:
-                    raise ValueError(f"無效的單位數據偏移範圍: {offset} - {offset1}")
-                
-                unit_data = UnitData()
-                unit_data.data = self.get_sub_array(data, offset, offset1 - offset)
-                self.unit_data_set.append(unit_data)
-                p += 4
+                raise ValueError(f"無效的單位數據偏移: {offsets[i]}")
+            raise ValueError(f"無效的單位數據偏移範圍: {offsets[i]} - {ends[i]}")
+        
+        return list(zip(offsets.tolist(), (ends - offsets).tolist()))
+    
+    def _parse_fb2_structure(self, data):
+        """解析FB2檔案結構"""
+        self._saved_unit_layout = self._read_fb2_unit_layout(data)
+        
+        # 解析單位數據
+        for offset, length in self._saved_unit_layout:
+            unit_data = UnitData()
+            unit_data.data = self.get_sub_array(data, offset, length)
+            self.unit_data_set.append(unit_data)
+        
+        self._saved_unit_data = [unit_data.data for unit_data in self.unit_data_set]
+        self._saved_fb2_size = len(data)
+    
+    def _parse_fb2_structure_mapped(self, mapped):
+        """以記憶體映射解析FB2檔案結構：一次讀取整個偏移表，單元數據在首次存取時才切出"""
+        self._saved_unit_layout = self._read_fb2_unit_layout(mapped.buffer)
+        
+        for offset, length in self._saved_unit_layout:
+            unit_data = UnitData()
+            unit_data.map_to(mapped, offset, offset + length)
+            self.unit_data_set.append(unit_data)
+        
+        self._saved_unit_data = []
+        self._saved_fb2_size = len(mapped)
+    
+    def _unmap_fb2_file(self):
+        """釋放所有單元對映射檔案的引用並關閉映射"""
+        if self._mapped is None:
+            return
+        for unit_data in self.unit_data_set:
+            unit_data.unmap()
+        self._mapped.close()
+        self._mapped = None
+    
+    def _remap_fb2_file(self, unit_layout):
+        """重新映射FB2檔案：unit_layout為新寫入檔案的單元位置時所有單元改為引用新檔案，None時未修改的單元引用原來的範圍"""
+        self._mapped = MappedFile(self.fb2_file)
+        for i, unit_data in enumerate(self.unit_data_set):
+            if unit_layout is not None:
+                offset, length = unit_layout[i]
+                unit_data.map_to(self._mapped, offset, offset + length)
+            elif unit_data.is_mapped():
+                unit_data.map_to(self._mapped, *unit_data._range)
+    
+    def get_unit_data(self, unit_index):
+        """獲取單元的壓縮數據（延遲載入時為檔案的零複製切片）"""
+        return self.unit_data_set[unit_index].data
     
     def dispose(self):
         """釋放資源"""
+        self._unmap_fb2_file()
         self.unit_data_set.clear()
     
     def get_map_draw_data(self):
         """獲取地圖繪製數據"""
-        ret = bytearray(self.map_x * self.BLOCK_X_LIMIT * self.map_y * self.BLOCK_Y_LIMIT * 2)
-        p = 0
-        
-        for i in range(len(self.unit_index)):
-            # 檢查索引是否有效
-            if self.unit_index[i] < 0 or self.unit_index[i] >= len(self.unit_data_set):
-                raise ValueError(f"無效的單位索引: {self.unit_index[i]} (總共 {len(self.unit_data_set)} 個單位)")
-            
-            unit_data = self.get_draw_data(self.unit_data_set[self.unit_index[i]].data)
-            self.copy_buffer(unit_data, 0, ret, p, len(unit_data))
-            p += len(unit_data)
-        
-        return bytes(ret)
+        return self._get_tiles_draw_data(self.unit_index)
+    
+    def get_invalid_unit_index(self, unit_index=None):
+        """獲取所有超出單元範圍的MPL索引位置"""
+        if unit_index is None:
+            unit_index = self.unit_index
+        return np.flatnonzero((unit_index < 0) | (unit_index >= len(self.unit_data_set)))
+    
+    def _check_unit_index(self, unit_index):
+        """一次檢查所有單元索引，有無效索引時列出其位置及數值"""
+        invalid = self.get_invalid_unit_index(unit_index)
+        if len(invalid) == 0:
+            return
+        
+        entries = ', '.join(f"[{p}]={unit_index.flat[p]}" for p in invalid[:10].tolist())
+        if len(invalid) > 10:
+            entries += " ..."
+        raise ValueError(f"無效的單位索引 {len(invalid)} 個: {entries} (總共 {len(self.unit_data_set)} 個單位)")
+    
+    def _get_tiles_draw_data(self, unit_index):
+        """依單元索引陣列（列優先）組合繪製數據，每個使用到的單元只解壓一次"""
+        unit_index = unit_index.ravel()
+        self._check_unit_index(unit_index)
+        
+        unit_size = self.BLOCK_X_LIMIT * self.BLOCK_Y_LIMIT
+        used = np.unique(unit_index)
+        unit_pixels = np.zeros((len(used), unit_size), dtype='<u2')
+        for i, index in enumerate(used.tolist()):
+            draw_data = self.get_draw_data(self.get_unit_data(index))
+            count = min(len(draw_data) // 2, unit_size)
+            unit_pixels[i, :count] = np.frombuffer(draw_data, dtype='<u2', count=count)
+        
+        return unit_pixels[np.searchsorted(used, unit_index)].tobytes()
     
     def get_map_bitmap(self):
         """獲取地圖位圖"""
@@ -189,40 +273,183 @@ class FB2Info(BaseUnitInfo):
         return self.make_bitmap(draw_data, self.map_x * self.BLOCK_X_LIMIT, 
                                self.map_y * self.BLOCK_Y_LIMIT)
     
-    def save_bitmap_to_fb2_info(self, bitmap):
-        """從點陣圖儲存到 FB2 資訊"""
+    def get_map_region_bitmap(self, x, y, width, height):
+        """獲取地圖指定區域（像素座標）的位圖，只讀取及解壓與區域相交的單元"""
+        map_width = self.map_x * self.BLOCK_X_LIMIT
+        map_height = self.map_y * self.BLOCK_Y_LIMIT
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, map_width), min(y + height, map_height)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        
+        # 與區域相交的區塊範圍
+        block_x0 = x0 // self.BLOCK_X_LIMIT
+        block_y0 = y0 // self.BLOCK_Y_LIMIT
+        block_x1 = (x1 + self.BLOCK_X_LIMIT - 1) // self.BLOCK_X_LIMIT
+        block_y1 = (y1 + self.BLOCK_Y_LIMIT - 1) // self.BLOCK_Y_LIMIT
+        
+        region_index = self.unit_index.reshape(self.map_y, self.map_x)[block_y0:block_y1, block_x0:block_x1]
+        draw_data = self._get_tiles_draw_data(region_index)
+        
+        bitmap = self.make_bitmap(draw_data, (block_x1 - block_x0) * self.BLOCK_X_LIMIT,
+                                  (block_y1 - block_y0) * self.BLOCK_Y_LIMIT)
+        left = block_x0 * self.BLOCK_X_LIMIT
+        top = block_y0 * self.BLOCK_Y_LIMIT
+        return bitmap.crop((x0 - left, y0 - top, x1 - left, y1 - top))
+    
+    def save_bitmap_to_fb2_info(self, bitmap, workers=None, chunk_size=None):
+        """從點陣圖儲存到 FB2 資訊
+        
+        workers / chunk_size: 平行壓縮的工作行程數及每批區塊數，None時使用類別設定
+        """
+        width = self.map_x * self.BLOCK_X_LIMIT
+        height = self.map_y * self.BLOCK_Y_LIMIT
+        if bitmap.width < width or bitmap.height < height:
+            raise ValueError(f"點陣圖尺寸不足: 需要 {width} x {height}，實際 {bitmap.width} x {bitmap.height}")
+        
         self.unit_data_set.clear()
-        self.unit_index = [0] * (self.map_x * self.map_y)
+        self.unit_index = np.zeros(self.map_x * self.map_y, dtype=np.int16)
+        
+        # 將 8-bit RGB 一次轉換為 15-bit RGB555 大端序
+        raster = np.asarray(bitmap.convert('RGBA').crop((0, 0, width, height)))
+        colors = self.convert_to_rgb555(raster)
         
-        original_unit_data = bytearray(self.BLOCK_X_LIMIT * self.BLOCK_Y_LIMIT * 2)
+        # 透過共用的繪製索引收集為單元順序，即 (map_y, map_x, 24, 30) 的區塊
+        tiles = self._gather_draw_pixels(colors, width, height).reshape(
+            self.map_y, self.map_x, self.BLOCK_Y_LIMIT, self.BLOCK_X_LIMIT)
 
+        # 以區塊內容去除重複：相同的區塊只儲存一個單元，由MPL索引共用
+        unit_lookup = {}
+        unique_tiles = []
         for p in range(self.map_x * self.map_y):
             block_y = p // self.map_x
             block_x = p % self.map_x
             
-            start_x = block_x * self.BLOCK_X_LIMIT
-            start_y = block_y * self.BLOCK_Y_LIMIT
-            
-            pixel_data_pointer = 0
-            for j in range(self.BLOCK_Y_LIMIT):
-                for i in range(self.BLOCK_X_LIMIT):
-                    px_x = start_x + i
-                    px_y = start_y + j
-                    
-                    r, g, b, _ = bitmap.getpixel((px_x, px_y))
-                    
-                    # 將 8-bit RGB 轉換為 15-bit RGB555 大端序
-                    color_val = ((r & 0xF8) << 7) | ((g & 0xF8) << 2) | ((b & 0xF8) >> 3)
-                    Util.set_be_uint16(original_unit_data, pixel_data_pointer, color_val)
-                    pixel_data_pointer += 2
+            tile_data = tiles[block_y, block_x].tobytes()
+            index = unit_lookup.get(tile_data)
+            if index is None:
+                index = len(unique_tiles)
+                unit_lookup[tile_data] = index
+                unique_tiles.append(tile_data)
             
+            self.unit_index[p] = index
+        
+        for compressed in self._compress_tiles(unique_tiles, workers, chunk_size):
             ud = UnitData()
-            ud.data = self.compress_unit_data(bytes(original_unit_data))
+            ud.data = compressed
             self.unit_data_set.append(ud)
-            self.unit_index[p] = p
+    
+    def _compress_tiles(self, tiles, workers=None, chunk_size=None):
+        """壓縮所有區塊數據，區塊數量足夠時分批交由行程池平行處理，結果依原順序返回"""
+        if workers is None:
+            workers = self.PARALLEL_WORKERS or os.cpu_count() or 1
+        if chunk_size is None:
+            chunk_size = self.PARALLEL_CHUNK_SIZE
+        # 匯入的地圖必須能解壓回原本的像素，固定使用可正確解壓的最短壓縮方式（與save_bitmap_to_frame相同）
+        optimal = True
+        
+        if workers <= 1 or len(tiles) < max(self.PARALLEL_MIN_TILES, chunk_size * 2):
+            return [self.compress_unit_data(tile_data, optimal) for tile_data in tiles]
+        
+        chunks = [tiles[i:i + chunk_size] for i in range(0, len(tiles), chunk_size)]
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+                results = executor.map(_compress_tile_chunk, chunks, [optimal] * len(chunks))
+                return [compressed for chunk in results for compressed in chunk]
+        except (OSError, BrokenProcessPool) as e:
+            # 無法建立工作行程時（例如受限環境）改為單行程壓縮
+            print(f"平行壓縮失敗，改用單行程壓縮: {e}")
+            return [self.compress_unit_data(tile_data, optimal) for tile_data in tiles]
 
-    def save_fb2_to_file(self):
-        """保存FB2檔案"""
+    def save_fb2_to_file(self, incremental=None):
+        """保存FB2檔案，返回備份檔名
+        
+        incremental: 是否使用增量保存，None時使用類別設定。單元數量及大小都未變時，
+        只原地修補變更的單元數據，備份為記錄被覆蓋內容的日誌；否則完整重寫。
+        """
+        if incremental is None:
+            incremental = self.USE_INCREMENTAL_SAVE
+        
+        if incremental and self._can_patch_fb2_file():
+            backup_file = self._create_backup_file(self.fb2_file, ".FB2J")
+            patches = []
+            for i, (unit_data, (offset, length)) in enumerate(zip(self.unit_data_set, self._saved_unit_layout)):
+                if unit_data.is_mapped():
+                    continue
+                if unit_data.data != self._get_saved_unit_data(i, offset, length):
+                    patches.append((offset, unit_data.data))
+            self._patch_file_in_place(self.fb2_file, patches, backup_file)
+            self._mark_fb2_saved()
+            return backup_file
+        
+        return self._write_fb2_file()
+    
+    def save_mpl_to_file(self, incremental=None):
+        """保存MPL檔案，返回備份檔名
+        
+        incremental: 是否使用增量保存，None時使用類別設定。地圖尺寸未變時，
+        只原地修補變更的單元索引，備份為記錄被覆蓋內容的日誌；否則完整重寫。
+        """
+        if incremental is None:
+            incremental = self.USE_INCREMENTAL_SAVE
+        
+        if incremental and self._can_patch_mpl_file():
+            backup_file = self._create_backup_file(self.mpl_file, ".MPLJ")
+            current = np.asarray(self.unit_index, dtype=np.intp)
+            saved = np.asarray(self._saved_unit_index, dtype=np.intp)
+            
+            # 連續變更的索引合併為一次寫入（與載入時相同使用小端序）
+            changed = np.flatnonzero(current != saved)
+            patches = []
+            if len(changed):
+                for run in np.split(changed, np.flatnonzero(np.diff(changed) != 1) + 1):
+                    start, end = run[0], run[-1] + 1
+                    patches.append((0x0B + start * 2, current[start:end].astype('<i2').tobytes()))
+            
+            self._patch_file_in_place(self.mpl_file, patches, backup_file)
+            self._saved_unit_index = self.unit_index.copy()
+            return backup_file
+        
+        return self._write_mpl_file()
+    
+    def _mark_fb2_saved(self):
+        """記錄磁碟上的單元數據現況；延遲載入時已寫入的單元改為引用檔案中的範圍，不再佔用記憶體"""
+        if self._mapped is None:
+            self._saved_unit_data = [unit_data.data for unit_data in self.unit_data_set]
+            return
+        
+        for unit_data, (offset, length) in zip(self.unit_data_set, self._saved_unit_layout):
+            if not unit_data.is_mapped():
+                unit_data.map_to(self._mapped, offset, offset + length)
+        self._saved_unit_data = []
+    
+    def _get_saved_unit_data(self, unit_index, offset, length):
+        """獲取磁碟上的單元數據：延遲載入時直接從映射檔案切出，不存在時返回None"""
+        if self._mapped is not None:
+            return self._mapped.view(offset, offset + length)
+        if unit_index < len(self._saved_unit_data):
+            return self._saved_unit_data[unit_index]
+        return None
+    
+    def _can_patch_fb2_file(self):
+        """檢查能否原地修補FB2檔案：單元數量、各單元大小及檔案大小都與磁碟上的相同"""
+        if not self._saved_unit_layout or len(self.unit_data_set) != len(self._saved_unit_layout):
+            return False
+        if not os.path.exists(self.fb2_file) or os.path.getsize(self.fb2_file) != self._saved_fb2_size:
+            return False
+        return all(len(unit_data.data) == length
+                   for unit_data, (_, length) in zip(self.unit_data_set, self._saved_unit_layout))
+    
+    def _can_patch_mpl_file(self):
+        """檢查能否原地修補MPL檔案：單元索引數量與磁碟上的相同"""
+        if self._saved_unit_index is None or len(self.unit_index) != len(self._saved_unit_index):
+            return False
+        if not os.path.exists(self.mpl_file):
+            return False
+        return os.path.getsize(self.mpl_file) >= 0x0B + len(self.unit_index) * 2
+    
+    def _write_fb2_file(self):
+        """完整重寫FB2檔案：寫入暫存檔後，原檔案改名為備份再以暫存檔取代"""
         backup_file = self._create_backup_file(self.fb2_file, ".FB2")
         
         # 計算檔案大小
@@ -234,6 +461,7 @@ class FB2Info(BaseUnitInfo):
         file_data = bytearray(file_size)
         p_offset = 0x0F
         p_data = p_offset + 4 * len(self.unit_data_set)
+        unit_layout = []
         
         # 複製標頭
         file_data[:len(self.fb2_head)] = self.fb2_head
@@ -246,20 +474,28 @@ class FB2Info(BaseUnitInfo):
             Util.set_be_uint32(file_data, p_offset, p_data)
             p_offset += 4
             file_data[p_data:p_data+len(unit_data.data)] = unit_data.data
+            unit_layout.append((p_data, len(unit_data.data)))
             p_data += len(unit_data.data)
         
-        # 創建備份並寫入新檔案
-        if os.path.exists(self.fb2_file):
-            import shutil
-            shutil.copy2(self.fb2_file, backup_file)
-        
-        with open(self.fb2_file, 'wb') as f:
-            f.write(file_data)
-        
+        # 先解除映射（Windows上被映射的檔案無法改名）
+        mapped = self._mapped is not None
+        self._unmap_fb2_file()
+        try:
+            self._replace_file(self.fb2_file, file_data, backup_file)
+        except Exception:
+            if mapped:
+                self._remap_fb2_file(None)
+            raise
+        
+        self._saved_unit_layout = unit_layout
+        self._saved_fb2_size = file_size
+        if mapped:
+            self._remap_fb2_file(unit_layout)
+        self._mark_fb2_saved()
         return backup_file
     
-    def save_mpl_to_file(self):
-        """保存MPL檔案"""
+    def _write_mpl_file(self):
+        """完整重寫MPL檔案：寫入暫存檔後，原檔案改名為備份再以暫存檔取代"""
         backup_file = self._create_backup_file(self.mpl_file, ".MPL")
         
         # 計算檔案大小
@@ -279,18 +515,12 @@ class FB2Info(BaseUnitInfo):
         Util.set_be_uint16(file_data, 9, self.map_y)
         
         # 寫入單位索引
-        for index in self.unit_index:
-            Util.set_be_uint16(file_data, p_offset, index)
-            p_offset += 2
-        
-        # 創建備份並寫入新檔案
-        if os.path.exists(self.mpl_file):
-            import shutil
-            shutil.copy2(self.mpl_file, backup_file)
+        file_data[p_offset:] = np.asarray(self.unit_index, dtype='>i2').tobytes()
         
-        with open(self.mpl_file, 'wb') as f:
-            f.write(file_data)
+        self._replace_file(self.mpl_file, file_data, backup_file)
         
+        # 完整重寫使用的位元組序與載入時不同，之後不再原地修補
+        self._saved_unit_index = None
         return backup_file
     
     def _get_fb2_current_file_size(self):
@@ -310,10 +540,3 @@ class FB2Info(BaseUnitInfo):
             return -1
         
         return len(self.mpl_head) + len(self.unit_index) * 2
-    
-    def _create_backup_file(self, original_file, extension):
-        """創建備份檔案"""
-        now = datetime.now()
-        timestamp = now.strftime("%Y%m%d%H%M%S")
-        backup_name = f"{os.path.splitext(original_file)[0]}_Bak_{timestamp}{extension}"
-        return backup_name 
\ No newline at end of file
@@ -2,8 +2,10 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from PIL import Image, ImageTk
 import os
+import multiprocessing
 from saf_info import SAFInfo
 from fb2_info import FB2Info
+from base_unit_info import BaseUnitInfo
 import sys
 
 class SAFEditorApp:
@@ -42,6 +44,10 @@ class SAFEditorApp:
         self.bitmap_scale = 1
         self.current_file_name = ""
 
+        # FB2地圖顯示狀態：None表示目前不是顯示地圖，否則為最後繪製的可見範圍
+        self.fb2_viewport = None
+        self.fb2_render_pending = False
+
         # 自動播放相關變數
         self.is_playing = False
         self.play_timer = None
@@ -245,6 +251,12 @@ class SAFEditorApp:
         ttk.Button(export_right, text="匯出音效", command=self.export_saf_wave,
                   style="AppleSecondary.TButton").pack(fill=tk.X)
 
+        # 還原日誌備份按鈕（增量保存FB2/MPL時產生的備份）
+        restore_frame = ttk.Frame(file_frame, style='Apple.TFrame')
+        restore_frame.pack(fill=tk.X, pady=(6, 0))
+        ttk.Button(restore_frame, text="還原日誌備份", command=self.restore_journal_backup,
+                  style="AppleSecondary.TButton").pack(fill=tk.X)
+
         # 幀操作區塊
         frame_frame = ttk.LabelFrame(control_frame, text="幀操作",
                                    style='Apple.TLabelframe', padding=8)
@@ -465,7 +477,17 @@ class SAFEditorApp:
         v_scrollbar = ttk.Scrollbar(canvas_frame, orient=tk.VERTICAL, command=self.canvas.yview)
         v_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
-        self.canvas.configure(xscrollcommand=h_scrollbar.set, yscrollcommand=v_scrollbar.set)
+        # 捲動或調整大小時重新繪製FB2地圖的可見範圍
+        def on_xscroll(*args):
+            h_scrollbar.set(*args)
+            self.schedule_fb2_viewport()
+
+        def on_yscroll(*args):
+            v_scrollbar.set(*args)
+            self.schedule_fb2_viewport()
+
+        self.canvas.configure(xscrollcommand=on_xscroll, yscrollcommand=on_yscroll)
+        self.canvas.bind('<Configure>', lambda e: self.schedule_fb2_viewport())
 
         # 設置鍵盤快捷鍵
         self.setup_keyboard_shortcuts()
@@ -499,7 +521,9 @@ class SAFEditorApp:
         """設置縮放倍數"""
         self.scale_var.set(str(scale))
         self.bitmap_scale = scale
-        if self.current_bitmap:
+        if self.fb2_viewport is not None:
+            self.display_fb2_map()
+        elif self.current_bitmap:
             self.display_image(self.current_bitmap)
 
     def toggle_play(self):
@@ -646,16 +670,58 @@ class SAFEditorApp:
             self._open_fb2_file_internal(file_path)
     
     def display_fb2_map(self):
-        """顯示FB2地圖"""
+        """顯示FB2地圖：捲動範圍為整張地圖，但只繪製畫布可見範圍內的區域"""
         if not self.fb2_info:
             return
         
+        map_width = self.fb2_info.map_x * self.fb2_info.BLOCK_X_LIMIT
+        map_height = self.fb2_info.map_y * self.fb2_info.BLOCK_Y_LIMIT
+        self.canvas.delete("all")
+        self.canvas.configure(scrollregion=(0, 0, map_width * self.bitmap_scale, map_height * self.bitmap_scale))
+        self.fb2_viewport = ()
+        self.render_fb2_viewport()
+    
+    def schedule_fb2_viewport(self):
+        """畫布捲動或調整大小後，在閒置時重新繪製地圖的可見範圍（合併連續的捲動事件）"""
+        if self.fb2_viewport is None or self.fb2_render_pending:
+            return
+        self.fb2_render_pending = True
+        self.root.after_idle(self.render_fb2_viewport)
+    
+    def render_fb2_viewport(self):
+        """繪製FB2地圖在畫布可見範圍內的區域（只解壓可見的單元），可見範圍未變時不重新繪製"""
+        self.fb2_render_pending = False
+        if not self.fb2_info or self.fb2_viewport is None:
+            return
+        
+        # 可見範圍換算為地圖像素座標，多取一個像素涵蓋捲動到一半的邊緣
+        scale = self.bitmap_scale
+        left = max(int(self.canvas.canvasx(0)) // scale, 0)
+        top = max(int(self.canvas.canvasy(0)) // scale, 0)
+        width = max(self.canvas.winfo_width(), 1) // scale + 2
+        height = max(self.canvas.winfo_height(), 1) // scale + 2
+        viewport = (left, top, width, height, scale)
+        if viewport == self.fb2_viewport:
+            return
+        
         try:
-            map_bitmap = self.fb2_info.get_map_bitmap()
-            if map_bitmap:
-                self.display_image(map_bitmap)
+            region_bitmap = self.fb2_info.get_map_region_bitmap(left, top, width, height)
         except Exception as e:
+            self.fb2_viewport = None
             messagebox.showerror("錯誤", f"顯示地圖時發生錯誤：{str(e)}")
+            return
+        
+        self.fb2_viewport = viewport
+        self.canvas.delete("all")
+        if region_bitmap is None:
+            return
+        
+        scaled_image = region_bitmap.resize(
+            (region_bitmap.width * scale, region_bitmap.height * scale),
+            Image.Resampling.NEAREST
+        )
+        self.photo_image = ImageTk.PhotoImage(scaled_image)
+        self.canvas.create_image(left * scale, top * scale, anchor=tk.NW, image=self.photo_image)
     
     def update_frame_display(self):
         """更新幀顯示"""
@@ -683,21 +749,8 @@ class SAFEditorApp:
     
     def make_black_transparent(self, image):
         """後製濾鏡：將圖像中的純黑像素變為透明（僅用於導出）"""
-        if image.mode != 'RGBA':
-            image = image.convert('RGBA')
-        
-        new_image = image.copy()
-        pixels = new_image.load()
-        if pixels is None:
-            return image
-
-        for y in range(new_image.height):
-            for x in range(new_image.width):
-                r, g, b, a = pixels[x, y]
-                # 只處理完全不透明的黑色像素
-                if r == 0 and g == 0 and b == 0 and a == 255:
-                    pixels[x, y] = (0, 0, 0, 0)
-        return new_image
+        # 只處理完全不透明的黑色像素
+        return BaseUnitInfo.make_color_transparent(image, (0, 0, 0), alpha_condition=255)
 
     def resize_to_uniform_size(self, image):
         """將圖像調整為統一大小（優先左上角對齊，確保圖像顯示區域不偏移）"""
@@ -796,17 +849,12 @@ class SAFEditorApp:
             return
 
         try:
-            max_width = 0
-            max_height = 0
-            frame_count = 0
-
-            # 檢查所有幀的大小
-            for i in range(self.saf_info.get_frame_count()):
-                frame_bitmap = self.saf_info.get_frame_bitmap(i)
-                if frame_bitmap:
-                    max_width = max(max_width, frame_bitmap.width)
-                    max_height = max(max_height, frame_bitmap.height)
-                    frame_count += 1
+            # 由所有幀的外框計算大小（幀位圖從原點到外框右下角），不需繪製任何幀
+            boxes = self.saf_info.get_frame_bounding_boxes()
+            drawn = (boxes[:, 2] > 0) & (boxes[:, 3] > 0)
+            frame_count = int(drawn.sum())
+            max_width = int(boxes[drawn, 2].max()) if frame_count else 0
+            max_height = int(boxes[drawn, 3].max()) if frame_count else 0
 
             if max_width > 0 and max_height > 0:
                 # 更新內部變量
@@ -839,6 +887,9 @@ class SAFEditorApp:
         if not image:
             return
         
+        # 改為顯示單張圖像，不再繪製地圖的可見範圍
+        self.fb2_viewport = None
+        
         # 縮放圖像
         scaled_image = image.resize(
             (image.width * self.bitmap_scale, image.height * self.bitmap_scale),
@@ -951,7 +1002,11 @@ class SAFEditorApp:
 
         try:
             exported_count = 0
+            # 外框為空的幀沒有可繪製的圖層，不需要合成
+            boxes = self.saf_info.get_frame_bounding_boxes()
             for i in range(self.saf_info.get_frame_count()):
+                if boxes[i, 2] <= 0 or boxes[i, 3] <= 0:
+                    continue
                 frame_bitmap = self.saf_info.get_frame_bitmap(i)
                 if frame_bitmap:
                     # 後製處理：將黑色背景變為透明
@@ -1003,7 +1058,7 @@ class SAFEditorApp:
         try:
             backup_file = self.saf_info.save_saf_to_file(False)
             if backup_file:
-                messagebox.showinfo("成功", f"SAF檔案保存成功，備份檔案：{backup_file}")
+                messagebox.showinfo("成功", f"SAF檔案保存成功，備份檔案（保存前的完整檔案）：{backup_file}")
             else:
                 messagebox.showerror("錯誤", "保存SAF檔案失敗")
         except Exception as e:
@@ -1017,18 +1072,59 @@ class SAFEditorApp:
         
         try:
             backup_file = self.fb2_info.save_fb2_to_file()
-            if backup_file:
-                messagebox.showinfo("成功", f"FB2檔案保存成功，備份檔案：{backup_file}")
+            if backup_file and backup_file.upper().endswith(".FB2J"):
+                # 增量保存：備份只記錄被覆蓋的原始內容，無法直接開啟
+                messagebox.showinfo("成功", f"FB2檔案已原地保存，日誌備份：{backup_file}\n"
+                                          f"日誌備份只記錄被覆蓋的內容，可用「還原日誌備份」還原為保存前的檔案")
+            elif backup_file:
+                messagebox.showinfo("成功", f"FB2檔案保存成功，備份檔案（保存前的完整檔案）：{backup_file}")
             else:
                 messagebox.showerror("錯誤", "保存FB2檔案失敗")
         except Exception as e:
             messagebox.showerror("錯誤", f"保存FB2檔案時發生錯誤：{str(e)}")
     
+    def restore_journal_backup(self):
+        """以日誌備份（.FB2J/.MPLJ）將目前開啟的FB2/MPL檔案還原為該次保存前的內容"""
+        if not self.fb2_info:
+            messagebox.showwarning("警告", "請先開啟要還原的FB2檔案")
+            return
+        
+        fb2_file = self.fb2_info.fb2_file
+        journal_file = filedialog.askopenfilename(
+            title="選擇日誌備份",
+            initialdir=os.path.dirname(fb2_file),
+            filetypes=[("日誌備份", "*.fb2j *.FB2J *.mplj *.MPLJ"), ("所有檔案", "*.*")]
+        )
+        if not journal_file:
+            return
+        
+        extension = os.path.splitext(journal_file)[1].upper()
+        target_file = {".FB2J": fb2_file, ".MPLJ": self.fb2_info.mpl_file}.get(extension)
+        if target_file is None:
+            messagebox.showerror("錯誤", "請選擇 .FB2J 或 .MPLJ 日誌備份")
+            return
+        
+        if not messagebox.askyesno("確認", f"將以日誌備份把 {target_file} 還原為該次保存前的內容，"
+                                         f"未保存的修改會遺失。\n多次保存時須由新到舊依序還原。是否繼續？"):
+            return
+        
+        # 還原前先釋放檔案映射，還原後重新開啟
+        self.fb2_info.dispose()
+        self.fb2_info = None
+        try:
+            BaseUnitInfo.restore_journal_backup(journal_file, target_file)
+            messagebox.showinfo("成功", f"已以日誌備份還原：{target_file}")
+        except Exception as e:
+            messagebox.showerror("錯誤", f"還原日誌備份時發生錯誤：{str(e)}")
+        self._open_fb2_file_internal(fb2_file)
+    
     def on_scale_changed(self, event):
         """縮放改變事件"""
         try:
             self.bitmap_scale = int(self.scale_var.get())
-            if self.current_bitmap:
+            if self.fb2_viewport is not None:
+                self.display_fb2_map()
+            elif self.current_bitmap:
                 self.display_image(self.current_bitmap)
         except ValueError:
             pass
@@ -1288,13 +1384,9 @@ class SAFEditorApp:
         if not self.saf_info or not self.saf_info.frame_parameter:
             return usage_stats
 
-        for i, fp in enumerate(self.saf_info.frame_parameter):
-            wave_index = fp.wave_index
+        for wave_index, frames in self.saf_info.get_wave_usage().items():
             if wave_index >= 0 and wave_index < len(self.saf_info.wave_data):
-                if wave_index not in usage_stats:
-                    usage_stats[wave_index] = {'count': 0, 'frames': []}
-                usage_stats[wave_index]['count'] += 1
-                usage_stats[wave_index]['frames'].append(i)
+                usage_stats[wave_index] = {'count': len(frames), 'frames': frames}
 
         return usage_stats
 
@@ -1499,17 +1591,11 @@ class SAFEditorApp:
 
         # 統計每個聲音的使用情況
         usage_stats = {}
-        for i, fp in enumerate(self.saf_info.frame_parameter):
-            wave_index = fp.wave_index
-
-            if wave_index not in usage_stats:
-                usage_stats[wave_index] = {
-                    'count': 0,
-                    'frames': []
-                }
-
-            usage_stats[wave_index]['count'] += 1
-            usage_stats[wave_index]['frames'].append(i)
+        for wave_index, frames in self.saf_info.get_wave_usage().items():
+            usage_stats[wave_index] = {
+                'count': len(frames),
+                'frames': frames
+            }
 
         # 顯示統計結果
         report.append("--- 聲音使用統計 ---")
@@ -1574,4 +1660,6 @@ def main():
     root.mainloop()
 
 if __name__ == "__main__":
+    # 打包後的執行檔使用行程池（FB2平行壓縮）時需要
+    multiprocessing.freeze_support()
     main() 
\ No newline at end of file
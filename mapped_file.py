@@ -0,0 +1,85 @@
+import mmap
+import os
+
+class MappedFile:
+    """唯讀記憶體映射的檔案，以memoryview切片提供零複製的數據存取（只有實際讀取的頁面才會載入）"""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file = open(file_path, 'rb')
+        try:
+            if os.fstat(self._file.fileno()).st_size > 0:
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                self.buffer = memoryview(self._mmap)
+            else:
+                # 空檔案無法映射
+                self._mmap = None
+                self.buffer = memoryview(b'')
+        except Exception:
+            self._file.close()
+            raise
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def view(self, start, end):
+        """獲取指定範圍的零複製切片"""
+        return self.buffer[start:end]
+
+    def close(self):
+        """解除映射並關閉檔案（Windows上被映射的檔案無法改名或取代，保存前必須先關閉）"""
+        if self._file is None:
+            return
+
+        self.buffer.release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # 仍有切片被外部持有時無法立即解除映射，交由垃圾回收處理
+                pass
+            self._mmap = None
+        self._file.close()
+        self._file = None
+
+class ChunkItem:
+    """檔案中的數據項目：數據可指向記憶體映射的檔案，首次存取時才切出零複製的memoryview"""
+    def __init__(self):
+        self._data = bytes()
+        self._mapped = None
+        self._range = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            start, end = self._range
+            self._data = self._mapped.view(start, end)
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self._mapped = None
+        self._range = None
+
+    def map_to(self, mapped, start, end):
+        """改為引用映射檔案中的數據範圍"""
+        self._data = None
+        self._mapped = mapped
+        self._range = (start, end)
+
+    def unmap(self):
+        """關閉映射前釋放對映射檔案的引用（保留原範圍），之後須再以map_to指向映射檔案"""
+        if self._mapped is not None:
+            self._data = None
+            self._mapped = None
+
+    def is_mapped(self):
+        """數據是否仍引用檔案中的原始範圍（未被修改）"""
+        return self._range is not None
+
+    def get_size(self):
+        """獲取數據長度（不需切出數據）"""
+        if self._data is None:
+            return self._range[1] - self._range[0]
+        return len(self._data)
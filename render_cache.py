@@ -0,0 +1,81 @@
+from collections import OrderedDict
+
+class RenderCache:
+    """以位元組預算淘汰的LRU快取（用於解壓單元、位圖等繪製中間結果）"""
+
+    def __init__(self, max_bytes, size_of=None):
+        self.max_bytes = max_bytes
+        self.size_of = size_of if size_of is not None else RenderCache._default_size_of
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _default_size_of(value):
+        """估算快取項目佔用的位元組數"""
+        if hasattr(value, 'nbytes'):
+            return value.nbytes
+        if hasattr(value, 'width') and hasattr(value, 'height'):
+            return value.width * value.height * len(value.getbands())
+        return len(value)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """獲取快取項目，未命中時返回None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value):
+        """加入快取項目，超出預算時淘汰最久未使用的項目"""
+        size = self.size_of(value)
+        self.invalidate(key)
+
+        # 單一項目超過預算時不快取
+        if size > self.max_bytes:
+            return
+
+        self._entries[key] = (value, size)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_size
+
+    def invalidate(self, key):
+        """使指定項目失效"""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+    def invalidate_if(self, predicate):
+        """使所有鍵符合條件的項目失效"""
+        for key in [key for key in self._entries if predicate(key)]:
+            self.invalidate(key)
+
+    def clear(self):
+        """清除所有項目"""
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def get_stats(self):
+        """獲取快取統計"""
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
@@ -1,10 +1,11 @@
 import struct
-import os
-from datetime import datetime
 from PIL import Image
+import numpy as np
 from base_unit_info import BaseUnitInfo
 from util import Util
 from alpha2_config import Alpha2Config
+from render_cache import RenderCache
+from mapped_file import MappedFile, ChunkItem
 
 class WaveHeader:
     """波形標頭"""
@@ -27,54 +28,246 @@ class WaveHeader:
         self.DATA = bytes()
         self.DataSize = 0
 
-class UnitDataSet:
+class UnitDataSet(ChunkItem):
     """單元數據集"""
-    def __init__(self):
-        self.data = bytes()
 
-class FrameConstruct:
+class FrameConstruct(ChunkItem):
     """幀結構"""
     def __init__(self):
-        self.data = bytes()
+        super().__init__()
         self.x = 0
         self.y = 0
         self.bitmap = None
 
+# 參數單元的記錄格式（13字節，無對齊填充）：幀索引、繪製X、繪製Y、透明度、紅、綠、藍
+PARAMETER_DTYPE = np.dtype([
+    ('frame_index', '<i2'),
+    ('draw_x', '<i2'),
+    ('draw_y', '<i2'),
+    ('alpha', 'u1'),
+    ('red', '<i2'),
+    ('green', '<i2'),
+    ('blue', '<i2')
+])
+
+def _record_field(name):
+    """建立讀寫記錄陣列中指定欄位的屬性"""
+    def get(self):
+        return int(self._records[name][self._index])
+    
+    def set(self, value):
+        self._records[name][self._index] = value
+    
+    return property(get, set)
+
 class ParameterUnit:
-    """參數單元"""
-    def __init__(self):
-        self.frame_index = 0
-        self.draw_x = 0
-        self.draw_y = 0
-        self.alpha = 0
-        self.red = 0
-        self.green = 0
-        self.blue = 0
-
-class FrameParameter:
+    """參數單元（幀參數記錄陣列中一筆記錄的檢視，修改會寫回陣列）"""
+    __slots__ = ('_records', '_index')
+    
+    frame_index = _record_field('frame_index')
+    draw_x = _record_field('draw_x')
+    draw_y = _record_field('draw_y')
+    alpha = _record_field('alpha')
+    red = _record_field('red')
+    green = _record_field('green')
+    blue = _record_field('blue')
+    
+    def __init__(self, records=None, index=0):
+        if records is None:
+            records = np.zeros(1, dtype=PARAMETER_DTYPE)
+        self._records = records
+        self._index = index
+
+class FrameParameter(ChunkItem):
     """幀參數"""
     def __init__(self):
-        self.data = bytes()
-        self.params = []
-        self.wave_index = 0
-
-class WaveData:
+        super().__init__()
+        # 此幀的參數單元記錄及音效索引（載入後為FrameParameterStore中陣列的檢視）
+        self.records = np.zeros(0, dtype=PARAMETER_DTYPE)
+        self._wave_index = np.zeros(1, dtype=np.int16)
+    
+    @property
+    def params(self):
+        """參數單元列表（每次存取時建立記錄的檢視）"""
+        return [ParameterUnit(self.records, i) for i in range(len(self.records))]
+    
+    @property
+    def wave_index(self):
+        return int(self._wave_index[0])
+    
+    @wave_index.setter
+    def wave_index(self, value):
+        self._wave_index[0] = value
+    
+    def attach(self, store, frame_index):
+        """改為引用欄位式儲存中指定幀的記錄"""
+        self.records = store.records[store.offsets[frame_index]:store.offsets[frame_index + 1]]
+        self._wave_index = store.wave_index[frame_index:frame_index + 1]
+    
+    def build_data(self):
+        """依目前的記錄及音效索引重建幀參數數據（保留標頭其餘部分及記錄之後的數據），數據不完整時返回None"""
+        data = self.data
+        if len(data) < 10:
+            return None
+        end = 10 + len(self.records) * PARAMETER_DTYPE.itemsize
+        return (self.wave_index.to_bytes(2, 'little', signed=True) + bytes(data[2:10]) +
+                self.records.tobytes() + bytes(data[end:]))
+
+class FrameParameterStore:
+    """所有幀參數的欄位式儲存：參數單元記錄依幀串接成一個結構化陣列，以每幀起始位置分段"""
+    def __init__(self, frame_parameter):
+        frame_count = len(frame_parameter)
+        counts = np.zeros(frame_count, dtype=np.intp)
+        self.wave_index = np.zeros(frame_count, dtype=np.int16)
+        
+        record_lists = []
+        for i, fp in enumerate(frame_parameter):
+            data = fp.data
+            if data and len(data) >= 10:
+                self.wave_index[i] = Util.get_le_int16(data, 0)
+                param_count = Util.get_le_int16(data, 8)
+                # 只讀取完整的記錄
+                counts[i] = max(0, min(param_count, (len(data) - 10) // PARAMETER_DTYPE.itemsize))
+                record_lists.append(Util.get_typed_array(data, 10, counts[i], PARAMETER_DTYPE))
+        
+        # 串接時會複製數據，不再引用檔案映射
+        self.records = np.concatenate(record_lists) if record_lists else np.zeros(0, dtype=PARAMETER_DTYPE)
+        self.offsets = np.zeros(frame_count + 1, dtype=np.intp)
+        np.cumsum(counts, out=self.offsets[1:])
+        # 每筆記錄所屬的幀索引
+        self.record_frames = np.repeat(np.arange(frame_count, dtype=np.intp), counts)
+        
+        for i, fp in enumerate(frame_parameter):
+            fp.attach(self, i)
+    
+    def __len__(self):
+        return len(self.wave_index)
+    
+    def get_wave_usage(self):
+        """獲取每個音效索引（包含-1靜音及無效索引）使用的幀列表 {音效索引: [幀索引]}"""
+        wave_indices, inverse = np.unique(self.wave_index, return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        groups = np.split(order, np.cumsum(np.bincount(inverse, minlength=len(wave_indices)))[:-1])
+        return {int(wave_index): frames.tolist() for wave_index, frames in zip(wave_indices, groups)}
+    
+    def get_bounding_boxes(self, construct_width, construct_height):
+        """依FrameConstruct尺寸計算每幀所有圖層的外框，返回 (幀數, 4) 的 [左, 上, 右, 下] 陣列
+        
+        沒有有效圖層的幀外框為全0。
+        """
+        frame_indices = self.records['frame_index'].astype(np.intp)
+        valid = (frame_indices >= 0) & (frame_indices < len(construct_width))
+        valid[valid] &= (construct_width[frame_indices[valid]] > 0) & (construct_height[frame_indices[valid]] > 0)
+        
+        frames = self.record_frames[valid]
+        left = self.records['draw_x'][valid].astype(np.int64)
+        top = self.records['draw_y'][valid].astype(np.int64)
+        right = left + construct_width[frame_indices[valid]]
+        bottom = top + construct_height[frame_indices[valid]]
+        
+        boxes = np.zeros((len(self), 4), dtype=np.int64)
+        has_layer = np.zeros(len(self), dtype=bool)
+        has_layer[frames] = True
+        boxes[has_layer, 0:2] = np.iinfo(np.int64).max
+        boxes[has_layer, 2:4] = np.iinfo(np.int64).min
+        np.minimum.at(boxes[:, 0], frames, left)
+        np.minimum.at(boxes[:, 1], frames, top)
+        np.maximum.at(boxes[:, 2], frames, right)
+        np.maximum.at(boxes[:, 3], frames, bottom)
+        return boxes
+
+class WaveData(ChunkItem):
     """波形數據"""
     def __init__(self):
+        super().__init__()
         self.channels = 0
         self.bits = 0
         self.sample_rate = 0
         self.data_length = 0
-        self.data = bytes()
 
-class UnknownData:
+class UnknownData(ChunkItem):
     """未知數據"""
-    def __init__(self):
-        self.data = bytes()
+
+class UnitReferenceIndex:
+    """單元→FrameConstruct→幀的引用索引（一次掃描所有單元列表後以陣列計數建立）"""
+    def __init__(self, frame_construct, parameter_store, unit_count):
+        self.unit_count = unit_count
+        self.construct_count = len(frame_construct)
+        
+        # 將所有FrameConstruct的單元索引串接成一個陣列，並記錄每個引用所屬的FrameConstruct
+        unit_lists = []
+        for fc in frame_construct:
+            construct_data = fc.data[4:]
+            unit_lists.append(np.frombuffer(construct_data, dtype='<i2', count=len(construct_data) // 2))
+        lengths = np.array([len(units) for units in unit_lists], dtype=np.intp)
+        units = np.concatenate(unit_lists).astype(np.intp) if unit_lists else np.empty(0, dtype=np.intp)
+        constructs = np.repeat(np.arange(self.construct_count, dtype=np.intp), lengths)
+        
+        # 與_get_construct_units相同：略過負數及超出範圍的索引
+        valid = (units >= 0) & (units < unit_count)
+        self.reference_counts, self._unit_offsets, self._unit_constructs = \
+            self._group(units[valid], constructs[valid], unit_count)
+        
+        # FrameConstruct→幀：每個幀的參數單元引用的FrameConstruct
+        constructs = parameter_store.records['frame_index'].astype(np.intp)
+        valid = (constructs >= 0) & (constructs < self.construct_count)
+        _, self._construct_offsets, self._construct_frames = \
+            self._group(constructs[valid], parameter_store.record_frames[valid], self.construct_count)
+    
+    @staticmethod
+    def _group(keys, values, key_count):
+        """依鍵將值分組：返回 (每個鍵的計數, 各組起始位置, 依鍵排序的值)"""
+        counts = np.bincount(keys, minlength=key_count)
+        offsets = np.zeros(key_count + 1, dtype=np.intp)
+        np.cumsum(counts, out=offsets[1:])
+        order = np.argsort(keys, kind='stable')
+        return counts, offsets, values[order]
+    
+    def get_multiplex_units(self):
+        """獲取被引用超過一次的所有單元索引"""
+        return np.flatnonzero(self.reference_counts > 1).tolist()
+    
+    def get_unit_constructs(self, unit_index):
+        """獲取使用指定單元的所有FrameConstruct索引"""
+        if not (0 <= unit_index < self.unit_count):
+            return []
+        constructs = self._unit_constructs[self._unit_offsets[unit_index]:self._unit_offsets[unit_index + 1]]
+        return np.unique(constructs).tolist()
+    
+    def get_construct_frames(self, frame_construct_index):
+        """獲取使用指定FrameConstruct的所有幀索引"""
+        if not (0 <= frame_construct_index < self.construct_count):
+            return []
+        frames = self._construct_frames[self._construct_offsets[frame_construct_index]:
+                                        self._construct_offsets[frame_construct_index + 1]]
+        return np.unique(frames).tolist()
+    
+    def get_unit_frames(self, unit_index):
+        """獲取修改指定單元時會受影響的所有幀索引"""
+        frames = [self._construct_frames[self._construct_offsets[i]:self._construct_offsets[i + 1]]
+                  for i in self.get_unit_constructs(unit_index)]
+        if not frames:
+            return []
+        return np.unique(np.concatenate(frames)).tolist()
 
 class SAFInfo(BaseUnitInfo):
     """SAF檔案信息類"""
     
+    # 解壓單元快取的位元組預算
+    UNIT_CACHE_BYTES = 32 * 1024 * 1024
+    # FrameConstruct透明位圖快取的位元組預算
+    CONSTRUCT_CACHE_BYTES = 64 * 1024 * 1024
+    # 合成幀位圖快取的位元組預算
+    FRAME_CACHE_BYTES = 64 * 1024 * 1024
+    
+    # 是否使用NumPy向量化的alpha=2效果處理（False時使用逐像素的參考實作）
+    USE_VECTORIZED_ALPHA2 = True
+    # 是否使用向量化的圖層顏色/透明度調整（False時使用逐像素的參考實作）
+    USE_VECTORIZED_ADJUST = True
+    
+    # 疊加增量表快取（依疊加次數及強度）
+    _overlay_gain_tables = {}
+    
     def __init__(self, file_path):
         super().__init__()
         
@@ -86,136 +279,128 @@ class SAFInfo(BaseUnitInfo):
         self.wave_data = []
         self.unknown_data1 = []
         
+        # 記憶體映射的SAF檔案（各項目數據引用其中的範圍）
+        self._mapped = None
+        
         # SAF檔案標頭
         self.saf_head = bytes([0x53, 0x41, 0x46, 0x05, 0x02, 0x74, 0x00, 0x1e, 0x00, 0x18, 0x00, 0x00])
         self.size_sector = 10 * (2 + 4 + 4) + 4  # 2字節個數+4字節起始地址+4字節結束地址
         self.offset_frame_parameter_begin = 0x74
         
+        # 原始檔案中各Chunk的位置 {類型: (起始位置, 長度, 項目數)}，及被修改過的Chunk類型
+        self._chunk_layout = {}
+        self._modified_chunks = set()
+        # 寫入時複製產生的單元 {新單元索引: 原單元索引}，保存時合併內容相同的單元
+        self._cow_units = {}
+        
+        # 欄位式的幀參數儲存（解析時建立）
+        self.parameter_store = None
+        # 單元引用索引（首次使用時建立，FrameConstruct或幀參數被修改時需重建）
+        self._reference_index = None
+        
+        # 解壓後的單元數據快取（依單元索引）
+        self.unit_cache = RenderCache(self.UNIT_CACHE_BYTES)
+        # 已處理透明色的FrameConstruct位圖快取（依FrameConstruct索引）
+        self.construct_cache = RenderCache(self.CONSTRUCT_CACHE_BYTES)
+        # 合成後的幀位圖快取（依幀索引及alpha=2效果指紋）
+        self.frame_cache = RenderCache(self.FRAME_CACHE_BYTES)
+        
         # 解析SAF檔案
         self._parse_saf_file()
     
     def _parse_saf_file(self):
-        """解析SAF檔案"""
+        """解析SAF檔案：以記憶體映射開啟，只讀取Chunk目錄及偏移表，各項目數據在首次存取時才切出"""
         try:
-            with open(self.saf_file, 'rb') as f:
-                buffer = f.read()
-            
-            p = 12  # 從標頭後開始
-            i = 1
-            j = 1
-            
-            # 讀取第一個itemcount
-            itemcount = Util.get_le_int16(buffer, p)
+            self._mapped = MappedFile(self.saf_file)
+            buffer = self._mapped.buffer
             
-            while itemcount != 0:
-                itemstart = Util.get_le_int32(buffer, p + 2)
-                itemlength = Util.get_le_int32(buffer, p + 6)
+            # 從標頭後開始，以10字節的記錄讀取Chunk目錄（2字節個數+4字節起始地址+4字節長度），個數為0時結束
+            for i, (itemcount, itemstart, itemlength) in enumerate(Util.iter_records(buffer, 12, '<hII'), 1):
+                if itemcount == 0:
+                    break
+                p = 12 + (i - 1) * 10
                 last_item_end = itemstart + itemlength
                 
-                while j <= itemcount:
+                if itemcount > 0:
                     if i > 5:
                         raise Exception("出現未知Chunk")
                     
                     if i != 5:
-                        # 檢查itemstart+4是否超出buffer
-                        if itemstart + 4 > len(buffer):
-                            raise Exception(f"subitemstart超出檔案範圍: itemstart={itemstart}, buffer_size={len(buffer)}")
-                        subitemstart = Util.get_le_int32(buffer, itemstart)
-                        if j < itemcount:
-                            if itemstart + 8 > len(buffer):
-                                raise Exception(f"subitemend超出檔案範圍: itemstart={itemstart}, buffer_size={len(buffer)}")
-                            subitemend = Util.get_le_int32(buffer, itemstart + 4)
-                        else:
-                            subitemend = last_item_end
-                        # 檢查邊界
-                        if subitemstart >= len(buffer) or subitemend > len(buffer) or subitemstart >= subitemend:
-                            raise Exception(f"無效的數據範圍: start={subitemstart}, end={subitemend}, buffer_size={len(buffer)}")
-                        subdata = buffer[subitemstart:subitemend]
+                        self._chunk_layout[i] = (itemstart, itemlength, itemcount)
+                        starts, ends = self._read_chunk_ranges(buffer, itemstart, itemcount, last_item_end)
+                        ranges = zip(starts.tolist(), ends.tolist())
                     else:
                         if p + 2 + itemcount * 2 > len(buffer):
                             raise Exception(f"未知數據區塊超出範圍: p={p}, itemcount={itemcount}, buffer_size={len(buffer)}")
-                        subdata = buffer[p + 2:p + 2 + itemcount * 2]
+                        ranges = [(p + 2, p + 2 + itemcount * 2)] * itemcount
                     
-                    # 根據類型處理數據
-                    if i == 1:
-                        fp = FrameParameter()
-                        fp.data = subdata
-                        self.frame_parameter.append(fp)
-                    elif i == 2:
-                        fc = FrameConstruct()
-                        fc.data = subdata
-                        if len(subdata) >= 4:
-                            fc.x = Util.get_le_uint16(subdata, 0) * 30
-                            fc.y = Util.get_le_uint16(subdata, 2) * 24
-                        self.frame_construct.append(fc)
-                    elif i == 3:
-                        fd = UnitDataSet()
-                        fd.data = subdata
-                        self.unit_data_set.append(fd)
-                    elif i == 4:
-                        ud = WaveData()
-                        if len(subdata) >= 8:
-                            ud.channels = subdata[0]
-                            ud.bits = subdata[1]
-                            ud.sample_rate = Util.get_be_uint16(subdata, 2)
-                            ud.data_length = Util.get_be_int32(subdata, 4)
-                        ud.data = subdata
-                        self.wave_data.append(ud)
-                    elif i == 5:
-                        ud1 = UnknownData()
-                        ud1.data = subdata
-                        self.unknown_data1.append(ud1)
+                    # 根據類型建立項目（只記錄數據範圍，不複製數據）
+                    item_type = {1: FrameParameter, 2: FrameConstruct, 3: UnitDataSet, 4: WaveData, 5: UnknownData}[i]
+                    items = self._get_chunk_items(i)
+                    for start, end in ranges:
+                        item = item_type()
+                        item.map_to(self._mapped, start, end)
+                        items.append(item)
                     
-                    itemstart += 4
-                    j += 1
-                
-                p += 10
-                i += 1
-                j = 1
-                
-                # 讀取下一個itemcount
-                if p + 2 <= len(buffer):
-                    itemcount = Util.get_le_int16(buffer, p)
-                else:
-                    itemcount = 0
+                    if i == 2:
+                        for fc in items:
+                            if fc._range[1] - fc._range[0] >= 4:
+                                fc.x = Util.get_le_uint16(buffer, fc._range[0]) * 30
+                                fc.y = Util.get_le_uint16(buffer, fc._range[0] + 2) * 24
+                    elif i == 4:
+                        for ud in items:
+                            if ud._range[1] - ud._range[0] >= 8:
+                                header = buffer[ud._range[0]:ud._range[0] + 8]
+                                ud.channels = header[0]
+                                ud.bits = header[1]
+                                ud.sample_rate = Util.get_be_uint16(header, 2)
+                                ud.data_length = Util.get_be_int32(header, 4)
             
             # 處理幀參數
             self._process_frame_parameters()
             
         except Exception as e:
+            # 解析失敗時關閉映射，避免檔案一直被佔用
+            self._unmap_saf_file()
             raise Exception(f"解析SAF檔案時發生錯誤: {str(e)}")
     
+    def _get_chunk_items(self, chunk_type):
+        """獲取指定類型Chunk的項目列表"""
+        return {
+            1: self.frame_parameter,
+            2: self.frame_construct,
+            3: self.unit_data_set,
+            4: self.wave_data,
+            5: self.unknown_data1
+        }[chunk_type]
+    
+    @staticmethod
+    def _read_chunk_ranges(buffer, itemstart, itemcount, last_item_end):
+        """讀取Chunk的偏移表，返回各項目的起始及結束位置陣列（最後一個項目到Chunk結尾為止）"""
+        if itemstart + 4 * itemcount > len(buffer):
+            raise Exception(f"偏移表超出檔案範圍: itemstart={itemstart}, itemcount={itemcount}, buffer_size={len(buffer)}")
+        
+        starts = Util.get_typed_array(buffer, itemstart, itemcount, '<u4').astype(np.int64)
+        ends = np.append(starts[1:], last_item_end)
+        
+        # 檢查邊界
+        invalid = (starts >= len(buffer)) | (ends > len(buffer)) | (starts >= ends)
+        if np.any(invalid):
+            j = int(np.argmax(invalid))
+            raise Exception(f"無效的數據範圍: start={starts[j]}, end={ends[j]}, buffer_size={len(buffer)}")
+        return starts, ends
+    
     def _process_frame_parameters(self):
-        """處理幀參數"""
+        """處理幀參數：一次將所有幀的參數單元記錄解析為欄位式陣列"""
+        self.parameter_store = FrameParameterStore(self.frame_parameter)
+    
+    def _sync_frame_parameters(self):
+        """將參數單元記錄及音效索引的修改寫回幀參數數據，並標記幀參數Chunk已修改"""
         for fp in self.frame_parameter:
-            if fp.data and len(fp.data) >= 10:
-                param_count = Util.get_le_int16(fp.data, 8)
-                fp.wave_index = Util.get_le_int16(fp.data, 0)
-                tp = 10
-                
-                if param_count != 0:
-                    if fp.params is None:
-                        fp.params = []
-                    
-                    for j in range(param_count):
-                        if tp + 11 <= len(fp.data):  # 確保有足夠的數據
-                            pu = ParameterUnit()
-                            pu.frame_index = Util.get_le_int16(fp.data, tp)
-                            tp += 2
-                            pu.draw_x = Util.get_le_int16(fp.data, tp)
-                            tp += 2
-                            pu.draw_y = Util.get_le_int16(fp.data, tp)
-                            tp += 2
-                            pu.alpha = fp.data[tp]
-                            tp += 1
-                            pu.red = Util.get_le_int16(fp.data, tp)
-                            tp += 2
-                            pu.green = Util.get_le_int16(fp.data, tp)
-                            tp += 2
-                            pu.blue = Util.get_le_int16(fp.data, tp)
-                            tp += 2
-                            
-                            fp.params.append(pu)
+            data = fp.build_data()
+            if data is not None and data != fp.data:
+                fp.data = data
+                self._modified_chunks.add(1)
     
     def get_frame_count(self):
         """獲取幀數量"""
@@ -238,33 +423,202 @@ class SAFInfo(BaseUnitInfo):
         if not (0 <= frame_construct_index < len(self.frame_construct)):
             return bytes()
 
+        all_unit_draw_data = []
+        for unit_index in self._get_construct_units(frame_construct_index):
+            unit_draw_data = self._get_unit_draw_data(unit_index)
+            if unit_draw_data:
+                all_unit_draw_data.append(unit_draw_data)
+                
+        return b''.join(all_unit_draw_data)
+    
+    def _get_construct_units(self, frame_construct_index):
+        """獲取FrameConstruct依繪製順序使用的有效單元索引"""
+        return [unit_index for _, unit_index in self._get_construct_unit_slots(frame_construct_index)]
+    
+    def _get_construct_unit_slots(self, frame_construct_index):
+        """獲取FrameConstruct依繪製順序使用的有效單元：[(在單元列表中的位置, 單元索引)]"""
         # FrameConstruct數據的前4字節是寬高，之後是單元索引列表
         construct_data = self.frame_construct[frame_construct_index].data[4:]
-        all_unit_draw_data = bytearray()
+        unit_slots = []
         p = 0
         while p + 2 <= len(construct_data):
             # 根據測試，此處也應為小端序
             unit_index = Util.get_le_int16(construct_data, p)
+            slot = p // 2
             p += 2
             
             if unit_index < 0:
                 continue
             if not (0 <= unit_index < len(self.unit_data_set)):
                 continue
-                
-            unit_data = self.unit_data_set[unit_index].data
-            if unit_data:
-                # 調用基類的get_draw_data解壓單元數據
-                unit_draw_data = self.get_draw_data(unit_data)
-                all_unit_draw_data.extend(unit_draw_data)
-                
-        return bytes(all_unit_draw_data)
+            
+            unit_slots.append((slot, unit_index))
+        
+        return unit_slots
+    
+    def _set_construct_unit(self, frame_construct_index, slot, unit_index):
+        """將FrameConstruct單元列表中指定位置改為引用另一個單元"""
+        fc = self.frame_construct[frame_construct_index]
+        construct_data = bytearray(fc.data)
+        Util.set_le_uint16(construct_data, 4 + slot * 2, unit_index)
+        fc.data = bytes(construct_data)
+        self._modified_chunks.add(2)
+        self.invalidate_construct(frame_construct_index)
+    
+    def _split_shared_unit(self, frame_construct_index, slot, unit_index, unit_data):
+        """寫入時複製：為FrameConstruct的指定位置建立原單元的私有副本並寫入新數據，返回新單元索引"""
+        new_index = len(self.unit_data_set)
+        if new_index > 0x7FFF:
+            raise Exception(f"單元數量超出上限，無法分離共用單元: {unit_index}")
+        
+        unit = UnitDataSet()
+        unit.data = unit_data
+        self.unit_data_set.append(unit)
+        self._modified_chunks.add(3)
+        self._cow_units[new_index] = unit_index
+        
+        self._set_construct_unit(frame_construct_index, slot, new_index)
+        return new_index
+    
+    def _fold_cow_units(self):
+        """將寫入時複製產生、但內容與同源單元相同的單元合併回共用單元，返回被合併的單元數量"""
+        if not self._cow_units:
+            return 0
+        
+        unit_count = len(self.unit_data_set)
+        remap = np.arange(unit_count, dtype=np.intp)
+        
+        # 依原單元分組，組內解壓後像素相同的單元都改為引用最早的一個
+        canonical = {}
+        folded = set()
+        for new_index, origin in self._cow_units.items():
+            group = canonical.setdefault(origin, {self._get_unit_draw_data(origin): origin})
+            draw_data = self._get_unit_draw_data(new_index)
+            target = group.setdefault(draw_data, new_index)
+            if target != new_index:
+                remap[new_index] = target
+                folded.add(new_index)
+        
+        if folded:
+            # 移除被合併的單元，其後的單元索引往前移
+            kept = np.ones(unit_count, dtype=bool)
+            kept[list(folded)] = False
+            compacted = np.cumsum(kept) - 1
+            remap = compacted[remap]
+            self.unit_data_set = [unit for unit, keep in zip(self.unit_data_set, kept) if keep]
+            
+            for fc in self.frame_construct:
+                construct_data = fc.data[4:]
+                units = np.frombuffer(construct_data, dtype='<i2', count=len(construct_data) // 2).astype(np.intp)
+                valid = (units >= 0) & (units < unit_count)
+                remapped = units.copy()
+                remapped[valid] = remap[units[valid]]
+                if np.array_equal(remapped, units):
+                    continue
+                fc.data = bytes(fc.data[:4]) + remapped.astype('<i2').tobytes() + bytes(fc.data[4 + len(units) * 2:])
+            
+            # 索引改變的單元需重新解壓；合併後像素不變，FrameConstruct及幀位圖快取仍然有效
+            first_folded = min(folded)
+            self.unit_cache.invalidate_if(lambda key: key >= first_folded)
+            self.invalidate_reference_index()
+            self._modified_chunks.update((2, 3))
+        
+        self._cow_units.clear()
+        return len(folded)
+    
+    def _get_unit_draw_data(self, unit_index):
+        """獲取解壓後的單元繪製數據（經由解壓單元快取）"""
+        unit_draw_data = self.unit_cache.get(unit_index)
+        if unit_draw_data is not None:
+            return unit_draw_data
+        
+        unit_data = self.unit_data_set[unit_index].data
+        if not unit_data:
+            return b''
+        
+        # 調用基類的get_draw_data解壓單元數據
+        unit_draw_data = self.get_draw_data(unit_data)
+        self.unit_cache.put(unit_index, unit_draw_data)
+        return unit_draw_data
+    
+    def _set_unit_data(self, unit_index, unit_data):
+        """替換單元的壓縮數據並使相關快取失效"""
+        self.unit_data_set[unit_index].data = unit_data
+        self._modified_chunks.add(3)
+        self.invalidate_unit(unit_index)
+    
+    def invalidate_unit(self, unit_index):
+        """單元數據被修改後，使相關快取失效"""
+        self.unit_cache.invalidate(unit_index)
+        for construct_index in self.get_unit_constructs(unit_index):
+            self.invalidate_construct(construct_index)
+    
+    def invalidate_construct(self, frame_construct_index):
+        """FrameConstruct被修改後，使相關快取失效"""
+        self.construct_cache.invalidate(frame_construct_index)
+        for frame_index in self.get_construct_frames(frame_construct_index):
+            self.invalidate_frame(frame_index)
+    
+    def invalidate_frame(self, frame_index):
+        """幀被修改後，使所有效果配置下的合成結果失效"""
+        self.frame_cache.invalidate_if(lambda key: key[0] == frame_index)
+    
+    def get_reference_index(self):
+        """獲取單元引用索引（首次使用時建立）"""
+        if self._reference_index is None:
+            self._reference_index = UnitReferenceIndex(self.frame_construct, self.parameter_store,
+                                                       len(self.unit_data_set))
+        return self._reference_index
+    
+    def invalidate_reference_index(self):
+        """FrameConstruct的單元列表、幀參數或單元數量被修改後，使引用索引失效"""
+        self._reference_index = None
+    
+    def get_multiplex_units(self):
+        """獲取所有被重複使用的單元索引"""
+        return self.get_reference_index().get_multiplex_units()
+    
+    def get_unit_constructs(self, unit_index):
+        """獲取修改指定單元時會受影響的所有FrameConstruct索引"""
+        return self.get_reference_index().get_unit_constructs(unit_index)
+    
+    def get_unit_frames(self, unit_index):
+        """獲取修改指定單元時會受影響的所有幀索引"""
+        return self.get_reference_index().get_unit_frames(unit_index)
+    
+    def get_frame_bounding_boxes(self):
+        """獲取每幀所有圖層的外框 (幀數, 4) 陣列 [左, 上, 右, 下]，沒有有效圖層的幀為全0
+        
+        合成的幀位圖從原點開始，大小即為外框的右、下邊界，不需繪製任何幀。沒有有效單元的FrameConstruct不繪製，不計入外框。
+        """
+        has_units = [bool(self._get_construct_unit_slots(i)) for i in range(len(self.frame_construct))]
+        construct_width = np.array([fc.x if drawn else 0 for fc, drawn in zip(self.frame_construct, has_units)],
+                                   dtype=np.int64)
+        construct_height = np.array([fc.y if drawn else 0 for fc, drawn in zip(self.frame_construct, has_units)],
+                                    dtype=np.int64)
+        return self.parameter_store.get_bounding_boxes(construct_width, construct_height)
+    
+    def get_wave_usage(self):
+        """獲取每個音效索引（包含-1靜音及無效索引）使用的幀列表 {音效索引: [幀索引]}"""
+        return self.parameter_store.get_wave_usage()
+    
+    def get_construct_frames(self, frame_construct_index):
+        """獲取使用指定FrameConstruct的所有幀索引"""
+        return self.get_reference_index().get_construct_frames(frame_construct_index)
+    
+    def get_unit_cache_stats(self):
+        """獲取解壓單元快取的命中統計"""
+        return self.unit_cache.get_stats()
 
     def _make_frame_construct_bitmap(self, frame_construct_index):
-        """將一個完整的FrameConstruct繪製成位圖"""
+        """將一個完整的FrameConstruct繪製成位圖（結果會被快取共用，請勿直接修改）"""
         if not (0 <= frame_construct_index < len(self.frame_construct)):
             return None
         
+        bitmap = self.construct_cache.get(frame_construct_index)
+        if bitmap is not None:
+            return bitmap
+        
         frame_x = self.get_frame_x(frame_construct_index)
         frame_y = self.get_frame_y(frame_construct_index)
         
@@ -275,39 +629,33 @@ class SAFInfo(BaseUnitInfo):
         if not draw_data:
             return None
         
-        # 調用基類的make_bitmap進行繪製，啟用透明度處理
-        bitmap = self.make_bitmap(draw_data, frame_x, frame_y, is_transparent=True)
+        # 調用基類的make_bitmap進行繪製，在RGB555轉換時即將黑色背景變為透明（與C#版本一致）
+        bitmap = self.make_bitmap(draw_data, frame_x, frame_y, is_transparent=True, color_key=(0, 0, 0))
         
-        # 確保黑色背景變為透明（與C#版本一致）
         if bitmap:
-            bitmap = self._make_black_transparent(bitmap)
+            self.construct_cache.put(frame_construct_index, bitmap)
         
         return bitmap
     
-    def _make_black_transparent(self, image):
-        """將黑色背景變為透明（模擬C#的MakeTransparent）"""
-        if image.mode != 'RGBA':
-            image = image.convert('RGBA')
-        
-        new_image = image.copy()
-        pixels = new_image.load()
-        if pixels is None:
-            return image
-
-        for y in range(new_image.height):
-            for x in range(new_image.width):
-                r, g, b, a = pixels[x, y]
-                # 將純黑色像素變為透明
-                if r == 0 and g == 0 and b == 0:
-                    pixels[x, y] = (0, 0, 0, 0)
-        
-        return new_image
-
     def get_frame_bitmap(self, frame_index):
-        """獲取最終合成的幀位圖"""
-        if 0 <= frame_index < len(self.frame_parameter):
-            return self._make_frame_bitmap(frame_index)
-        return None
+        """獲取最終合成的幀位圖（結果會被快取共用，請勿直接修改）"""
+        if not (0 <= frame_index < len(self.frame_parameter)):
+            return None
+        
+        key = self._get_frame_cache_key(frame_index)
+        bitmap = self.frame_cache.get(key)
+        if bitmap is None:
+            bitmap = self._make_frame_bitmap(frame_index)
+            if bitmap is not None:
+                self.frame_cache.put(key, bitmap)
+        return bitmap
+    
+    def _get_frame_cache_key(self, frame_index):
+        """合成幀快取鍵：包含幀目前的參數單元記錄（修改參數後不會取得舊結果），只有使用alpha=2圖層的幀才依賴效果配置"""
+        records = self.frame_parameter[frame_index].records
+        if np.any((records['alpha'] == 0x02) & (records['frame_index'] >= 0)):
+            return (frame_index, records.tobytes(), Alpha2Config.get_fingerprint())
+        return (frame_index, records.tobytes(), None)
     
     def _make_frame_bitmap(self, frame_index):
         """通過組合多個FrameConstruct來製作最終的幀位圖"""
@@ -348,6 +696,34 @@ class SAFInfo(BaseUnitInfo):
         return image
     
     def _adjust_unit_colors(self, bitmap, param):
+        """調整位圖顏色和透明度（基於C#邏輯，陣列運算；沒有變化時直接返回原位圖）"""
+        if not bitmap:
+            return bitmap
+
+        if not self.USE_VECTORIZED_ADJUST:
+            return self._adjust_unit_colors_reference(bitmap, param)
+
+        if param.alpha == 0x02:
+            # alpha=2 的特殊處理：半透明+高亮+重複疊加更鮮豔（效果處理本身不修改輸入）
+            return self._apply_alpha2_enhanced_effects(bitmap, param)
+
+        if param.alpha == 0x01:
+            # 調整為0.75，減少透明度（原本0.5太透明）；int(a * 0.75) == a * 3 // 4
+            alpha = np.asarray(bitmap.getchannel('A'))
+            if not alpha.any():
+                return bitmap
+            adjusted = bitmap.copy()
+            adjusted.putalpha(Image.fromarray((alpha.astype(np.uint16) * 3 // 4).astype(np.uint8), 'L'))
+            return adjusted
+
+        if param.alpha == 0x07:
+            # 白色為透明色
+            return self.make_color_transparent(bitmap, (255, 255, 255))
+
+        # 其他alpha值不改變任何像素
+        return bitmap
+
+    def _adjust_unit_colors_reference(self, bitmap, param):
         """調整位圖顏色和透明度（基於C#邏輯，像素級處理）"""
         if not bitmap:
             return bitmap
@@ -399,6 +775,10 @@ class SAFInfo(BaseUnitInfo):
         # 重複疊加次數（可配置）
         overlay_count = getattr(config, 'overlay_count', 3)  # 預設疊加3次
 
+        if self.USE_VECTORIZED_ALPHA2:
+            return self._apply_alpha2_enhanced_effects_vectorized(
+                bitmap, base_alpha, highlight_factor, saturation_boost, overlay_intensity, overlay_count)
+
         # 第一步：預處理原始圖像
         base_image = self._preprocess_alpha2_image(bitmap, highlight_factor, saturation_boost)
 
@@ -410,6 +790,93 @@ class SAFInfo(BaseUnitInfo):
 
         return final_image
 
+    def _apply_alpha2_enhanced_effects_vectorized(self, bitmap, base_alpha, highlight_factor,
+                                                  saturation_boost, overlay_intensity, overlay_count):
+        """以NumPy陣列運算執行完整的alpha=2效果流程（與逐像素版本結果一致）"""
+        pixels = np.array(bitmap.convert('RGBA'), dtype=np.int32)
+
+        # 第一步：預處理原始圖像
+        base = self._preprocess_alpha2_array(pixels, highlight_factor, saturation_boost)
+        base_image = Image.fromarray(base.astype(np.uint8), 'RGBA')
+
+        # 第二步：執行重複疊加
+        if overlay_count > 1:
+            # 第一層與逐像素版本相同，直接與透明圖像合成
+            first = Image.alpha_composite(Image.new('RGBA', base_image.size, (0, 0, 0, 0)), base_image)
+            result = self._perform_multiple_overlay_array(
+                np.array(first, dtype=np.int32), base, overlay_count, overlay_intensity)
+        else:
+            result = base
+
+        # 第三步：應用最終的透明度
+        alpha = result[:, :, 3]
+        result[:, :, 3] = np.where(alpha > 0, np.floor(alpha * base_alpha), alpha)
+
+        return Image.fromarray(result.astype(np.uint8), 'RGBA')
+
+    def _preprocess_alpha2_array(self, pixels, highlight_factor, saturation_boost):
+        """預處理alpha=2圖像陣列：高亮和飽和度增強（對應_preprocess_alpha2_image）"""
+        processed = pixels.copy()
+        rgb = pixels[:, :, :3].astype(np.float64)
+        visible = pixels[:, :, 3] != 0
+
+        # 黑色背景變為透明
+        black = self.apply_color_key(processed, (0, 0, 0)) & visible
+
+        # 1. 適中高亮處理
+        rgb = np.minimum(255, np.floor(rgb * highlight_factor + (255 - rgb) * 0.15))
+        if highlight_factor >= 1.5:
+            rgb = np.minimum(255, np.floor(rgb + (255 - rgb) * 0.2))
+
+        # 2. 飽和度增強
+        r, g, b = rgb[:, :, 0], rgb[:, :, 1], rgb[:, :, 2]
+        gray = np.floor(0.299 * r + 0.587 * g + 0.114 * b)[:, :, np.newaxis]
+        rgb = np.clip(np.trunc(gray + (rgb - gray) * saturation_boost), 0, 255)
+
+        enhance = visible & ~black
+        processed[:, :, :3][enhance] = rgb[enhance].astype(np.int32)
+        return processed
+
+    def _perform_multiple_overlay_array(self, result, base, overlay_count, overlay_intensity):
+        """以封閉形式計算多次加法疊加（對應_perform_multiple_overlay，成本與疊加次數無關）
+
+        每層疊加量只取決於像素的顏色值與alpha，且皆為非負，
+        因此逐層限制在255與一次相加後再限制的結果相同。
+        """
+        base_rgb = base[:, :, :3]
+        base_alpha = base[:, :, 3]
+
+        gain_table, max_intensity = self._get_overlay_gain_table(overlay_count, overlay_intensity)
+
+        # 加法混合：顏色相加但限制在255以內，透明度使用較大值
+        result[:, :, :3] = np.minimum(255, result[:, :, :3] + gain_table[base_rgb, base_alpha[:, :, np.newaxis]])
+        result[:, :, 3] = np.maximum(result[:, :, 3], np.floor(base_alpha * max_intensity).astype(np.int32))
+
+        return result
+
+    @classmethod
+    def _get_overlay_gain_table(cls, overlay_count, overlay_intensity):
+        """獲取疊加增量表：table[顏色, alpha] 為所有疊加層的顏色增量總和"""
+        key = (overlay_count, overlay_intensity)
+        cached = cls._overlay_gain_tables.get(key)
+        if cached is not None:
+            return cached
+
+        color = np.arange(256, dtype=np.int32)[:, np.newaxis]
+        alpha = np.arange(256, dtype=np.float64)
+        table = np.zeros((256, 256), dtype=np.int32)
+        max_intensity = 0.0
+
+        for i in range(1, overlay_count):
+            current_intensity = max(0.1, overlay_intensity * (1.0 - i * 0.1))
+            max_intensity = max(max_intensity, current_intensity)
+            # 保留每層各自的整數截斷
+            overlay_alpha = np.floor(alpha * current_intensity).astype(np.int32)
+            table += color * overlay_alpha[np.newaxis, :] // 255
+
+        cls._overlay_gain_tables[key] = (table, max_intensity)
+        return table, max_intensity
+
     def _preprocess_alpha2_image(self, bitmap, highlight_factor, saturation_boost):
         """預處理alpha=2圖像：高亮和飽和度增強"""
         processed = bitmap.copy()
@@ -535,26 +1002,276 @@ class SAFInfo(BaseUnitInfo):
 
     def has_multiplex_unit(self):
         """檢查是否有重複使用的圖元"""
-        # 實現檢查邏輯
-        return False
+        return bool(np.any(self.get_reference_index().reference_counts > 1))
     
     def save_bitmap_to_frame(self, bitmap, frame_index):
-        """保存位圖到幀"""
-        # 實現保存邏輯
-        pass
+        """保存位圖到幀：與目前合成的幀位圖比較，只把使用者實際修改的像素寫回幀底層圖層的FrameConstruct
+        
+        修改的像素必須位於底層圖層內、未被其他圖層覆蓋，且底層圖層未經透明度調整（alpha=0），
+        否則無法還原為單元數據而拋出例外。只重新壓縮含有修改像素的單元，返回重新壓縮的單元數量。
+        """
+        if not (0 <= frame_index < len(self.frame_parameter)):
+            return 0
+        
+        layers = [param for param in self.frame_parameter[frame_index].params
+                  if 0 <= param.frame_index < len(self.frame_construct)]
+        if not layers:
+            return 0
+        
+        # 以RGB555比較匯入的位圖與目前的幀位圖（透明像素以透明色（黑色）表示），大小不同時以透明補齊
+        new_raster = np.asarray(bitmap.convert('RGBA'))
+        current = self.get_frame_bitmap(frame_index)
+        old_raster = np.asarray(current) if current is not None else np.zeros((0, 0, 4), dtype=np.uint8)
+        height = max(new_raster.shape[0], old_raster.shape[0])
+        width = max(new_raster.shape[1], old_raster.shape[1])
+        
+        new_colors = np.zeros((height, width), dtype=np.uint16)
+        old_colors = np.zeros((height, width), dtype=np.uint16)
+        for colors, raster in ((new_colors, new_raster), (old_colors, old_raster)):
+            region = self.convert_to_rgb555(raster, dtype=np.uint16)
+            region[raster[:, :, 3] == 0] = 0
+            colors[:raster.shape[0], :raster.shape[1]] = region
+        
+        changed_mask = new_colors != old_colors
+        if not changed_mask.any():
+            return 0
+        
+        # 修改必須完全落在底層圖層內，且該範圍沒有被其他圖層覆蓋
+        param = layers[0]
+        construct_index = param.frame_index
+        frame_x = self.get_frame_x(construct_index)
+        frame_y = self.get_frame_y(construct_index)
+        
+        def get_layer_mask(layer):
+            mask = np.zeros((height, width), dtype=bool)
+            left, top = max(layer.draw_x, 0), max(layer.draw_y, 0)
+            right = layer.draw_x + self.get_frame_x(layer.frame_index)
+            bottom = layer.draw_y + self.get_frame_y(layer.frame_index)
+            mask[top:max(bottom, top), left:max(right, left)] = True
+            return mask
+        
+        if param.alpha != 0:
+            raise Exception(f"幀 {frame_index} 的底層圖層經過透明度調整（alpha={param.alpha}），無法寫回")
+        if (changed_mask & ~get_layer_mask(param)).any():
+            raise Exception(f"幀 {frame_index} 的修改超出底層圖層 {construct_index} 的範圍，無法寫回")
+        for layer in layers[1:]:
+            if (changed_mask & get_layer_mask(layer)).any():
+                raise Exception(f"幀 {frame_index} 的修改被圖層 {layer.frame_index} 覆蓋，無法寫回")
+        
+        # 轉換到FrameConstruct座標（底層圖層在畫布外的部分沒有修改）
+        local_colors = np.zeros((frame_y, frame_x), dtype=np.uint16)
+        local_mask = np.zeros((frame_y, frame_x), dtype=bool)
+        left, top = max(param.draw_x, 0), max(param.draw_y, 0)
+        right = min(param.draw_x + frame_x, width)
+        bottom = min(param.draw_y + frame_y, height)
+        local = (slice(top - param.draw_y, bottom - param.draw_y), slice(left - param.draw_x, right - param.draw_x))
+        local_colors[local] = new_colors[top:bottom, left:right]
+        local_mask[local] = changed_mask[top:bottom, left:right]
+        
+        # 依繪製緩衝區順序分塊（與_get_frame_draw_data相同的排列方式，空單元不佔位置）
+        unit_size = self.BLOCK_X_LIMIT * self.BLOCK_Y_LIMIT
+        tiles = self._gather_draw_pixels(local_colors, frame_x, frame_y).reshape(-1, unit_size)
+        tile_masks = self._gather_draw_pixels(local_mask, frame_x, frame_y).reshape(-1, unit_size)
+        
+        unit_slots = []
+        for slot, unit_index in self._get_construct_unit_slots(construct_index):
+            current_data = self._get_unit_draw_data(unit_index)
+            if current_data:
+                unit_slots.append((slot, unit_index, current_data))
+        if tile_masks[len(unit_slots):].any():
+            raise Exception(f"幀 {frame_index} 的修改位於FrameConstruct {construct_index} 沒有單元的區域，無法寫回")
+        
+        # 只重新壓縮含有修改像素的單元：以目前解壓的單元為基礎，只替換修改的像素
+        # 被其他位置共用的單元採寫入時複製，只分離出此位置的私有副本
+        reference_counts = self.get_reference_index().reference_counts.copy()
+        split = False
+        changed = 0
+        for tile_number, (slot, unit_index, current_data) in enumerate(unit_slots[:len(tiles)]):
+            tile_mask = tile_masks[tile_number]
+            if not tile_mask.any():
+                continue
+            
+            current_pixels = np.frombuffer(current_data, dtype='<u2', count=len(current_data) // 2)[:unit_size]
+            tile = np.zeros(unit_size, dtype=np.uint16)
+            tile[:len(current_pixels)] = current_pixels
+            tile[tile_mask] = tiles[tile_number][tile_mask]
+            
+            # 使用可正確解壓的最短壓縮方式重新壓縮
+            unit_data = self.compress_unit_data(tile.astype('>u2').tobytes(), optimal=True)
+            if reference_counts[unit_index] > 1:
+                self._split_shared_unit(construct_index, slot, unit_index, unit_data)
+                reference_counts[unit_index] -= 1
+                split = True
+            else:
+                self._set_unit_data(unit_index, unit_data)
+            changed += 1
+        
+        if split:
+            self.invalidate_reference_index()
+        
+        return changed
     
     def save_saf_to_file(self, is_delete_wave=False):
-        """保存SAF檔案"""
-        # 實現保存邏輯
-        return None
+        """保存SAF檔案：先依記憶體中的長度計算各Chunk位置，再以緩衝寫入串流輸出，返回備份檔名
+        
+        未修改且位置格式不變的Chunk直接從原始檔案的記憶體映射複製。
+        """
+        if self.saf_file is None:
+            return ""
+        
+        if is_delete_wave and self.wave_data:
+            # 刪除音效：所有幀改為靜音
+            for fp in self.frame_parameter:
+                if len(fp.data) >= 2:
+                    fp.data = b'\xff\xff' + bytes(fp.data[2:])
+                fp.wave_index = -1
+            self.wave_data.clear()
+            self._modified_chunks.update((1, 4))
+        
+        self._sync_frame_parameters()
+        self._fold_cow_units()
+        
+        chunks = {
+            1: self.frame_parameter,
+            2: self.frame_construct,
+            3: self.unit_data_set,
+            4: self.wave_data
+        }
+        
+        # 計算各Chunk的位置：偏移表 (4字節 * 項目數) 之後緊接各項目數據
+        layout = {}
+        p = self.offset_frame_parameter_begin
+        for chunk_type, items in chunks.items():
+            length = 4 * len(items) + sum(item.get_size() for item in items)
+            layout[chunk_type] = (p, length, len(items))
+            p += length
+        
+        backup_file = self._create_backup_file(self.saf_file, ".SAF")
+        
+        # 未修改的Chunk直接從目前的記憶體映射複製
+        source = self._mapped.buffer if self._mapped is not None else None
+        
+        def write_saf_file(f):
+            self._write_saf_head(f, source, layout)
+            for chunk_type, items in chunks.items():
+                self._write_saf_chunk(f, source, chunk_type, items, layout[chunk_type])
+        
+        # 取代前先解除映射（Windows上被映射的檔案無法改名）
+        try:
+            self._replace_file(self.saf_file, write_saf_file, backup_file, before_replace=self._unmap_saf_file)
+        except Exception:
+            # 取代失敗時各項目重新引用原檔案中的範圍
+            if self._mapped is None:
+                self._remap_saf_file(None)
+            raise
+        
+        # 所有項目改為引用新檔案，修改過的數據也不再佔用記憶體
+        self._remap_saf_file(layout)
+        
+        self._chunk_layout = layout
+        self._modified_chunks.clear()
+        return backup_file
+    
+    def _all_chunk_items(self):
+        """依序列出所有Chunk項目"""
+        for chunk_type in range(1, 6):
+            yield from self._get_chunk_items(chunk_type)
+    
+    def _unmap_saf_file(self):
+        """釋放所有項目對映射檔案的引用並關閉映射"""
+        if self._mapped is None:
+            return
+        for item in self._all_chunk_items():
+            item.unmap()
+        self._mapped.close()
+        self._mapped = None
+    
+    def _remap_saf_file(self, layout):
+        """重新映射SAF檔案
+        
+        layout為新寫入檔案的Chunk位置時，類型1~4的所有項目改為引用新檔案；
+        None時只讓未修改的項目重新引用原來的範圍。
+        """
+        self._mapped = MappedFile(self.saf_file)
+        buffer = self._mapped.buffer
+        
+        remapped = set()
+        if layout is not None:
+            for chunk_type, (start, length, count) in layout.items():
+                if count <= 0:
+                    continue
+                starts, ends = self._read_chunk_ranges(buffer, start, count, start + length)
+                for item, item_start, item_end in zip(self._get_chunk_items(chunk_type), starts.tolist(), ends.tolist()):
+                    item.map_to(self._mapped, item_start, item_end)
+                remapped.add(chunk_type)
+        
+        # 其餘項目（包含目錄中的未知數據，其位置在新舊檔案中相同）引用原來的範圍
+        for chunk_type in range(1, 6):
+            if chunk_type in remapped:
+                continue
+            for item in self._get_chunk_items(chunk_type):
+                if item.is_mapped():
+                    item.map_to(self._mapped, *item._range)
+    
+    def _write_saf_head(self, f, source, layout):
+        """寫入檔案標頭及Chunk目錄"""
+        head_size = len(self.saf_head)
+        if source is not None and len(source) >= self.offset_frame_parameter_begin:
+            head = source[:head_size]
+            # 保留原始目錄中的未知數據（第5類Chunk）
+            directory = bytearray(source[head_size:self.offset_frame_parameter_begin])
+        else:
+            head = self.saf_head
+            directory = bytearray(self.offset_frame_parameter_begin - head_size)
+        
+        for chunk_type, (start, length, count) in layout.items():
+            struct.pack_into('<hII', directory, (chunk_type - 1) * 10, count, start, length)
+        
+        f.write(head)
+        f.write(directory)
+    
+    def _write_saf_chunk(self, f, source, chunk_type, items, chunk):
+        """寫入一個Chunk：偏移表及各項目數據"""
+        start, length, count = chunk
+        table_size = 4 * count
+        
+        original = self._chunk_layout.get(chunk_type)
+        if (source is not None and original is not None and chunk_type not in self._modified_chunks and
+                original[1:] == (length, count) and original[0] + length <= len(source)):
+            original_start = original[0]
+            if original_start == start:
+                # 位置未變：整個Chunk直接從原始檔案複製
+                f.write(source[start:start + length])
+                return
+            
+            # 位置改變：只需平移偏移表，項目數據直接從原始檔案複製
+            offsets = struct.unpack_from(f'<{count}I', source, original_start)
+            f.write(struct.pack(f'<{count}I', *(offset - original_start + start for offset in offsets)))
+            f.write(source[original_start + table_size:original_start + length])
+            return
+        
+        offsets = []
+        p = start + table_size
+        for item in items:
+            offsets.append(p)
+            p += item.get_size()
+        f.write(struct.pack(f'<{count}I', *offsets))
+        for item in items:
+            f.write(item.data)
     
     def dispose(self):
         """釋放資源"""
+        self._unmap_saf_file()
         self.frame_parameter.clear()
         self.frame_construct.clear()
         self.unit_data_set.clear()
         self.wave_data.clear()
         self.unknown_data1.clear()
+        self.unit_cache.clear()
+        self.construct_cache.clear()
+        self.frame_cache.clear()
+        self._reference_index = None
+        self._cow_units.clear()
 
     def _make_csharp_wav_header(self, wave):
         """產生與C#一致的WAV header (固定44 bytes, 大端序)"""
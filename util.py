@@ -1,23 +1,52 @@
 import struct
+import numpy as np
+
+# 單一整數讀取使用的預先編譯格式
+_LE_INT16 = struct.Struct('<h')
+_LE_UINT16 = struct.Struct('<H')
+_LE_UINT32 = struct.Struct('<I')
+_BE_INT16 = struct.Struct('>h')
+_BE_UINT16 = struct.Struct('>H')
+_BE_UINT32 = struct.Struct('>I')
 
 class Util:
+    # 預先編譯的struct格式快取（依格式字串）
+    _structs = {}
+    STRUCT_CACHE_SIZE = 256
+    
+    # 整數寬度（字節數）及是否有號對應的struct格式字元
+    _INT_CODES = {
+        (1, True): 'b', (1, False): 'B',
+        (2, True): 'h', (2, False): 'H',
+        (4, True): 'i', (4, False): 'I',
+        (8, True): 'q', (8, False): 'Q'
+    }
+    
+    @staticmethod
+    def get_struct(fmt):
+        """獲取預先編譯的struct格式"""
+        compiled = Util._structs.get(fmt)
+        if compiled is None:
+            if len(Util._structs) >= Util.STRUCT_CACHE_SIZE:
+                Util._structs.clear()
+            compiled = struct.Struct(fmt)
+            Util._structs[fmt] = compiled
+        return compiled
+    
     @staticmethod
     def get_be_int32(array, offset):
         """從位元組陣列中讀取大端序32位整數"""
-        return struct.unpack('>I', array[offset:offset+4])[0]
+        return _BE_UINT32.unpack_from(array, offset)[0]
     
     @staticmethod
     def get_be_int16(array, offset):
         """從位元組陣列中讀取大端序16位整數"""
-        val = struct.unpack('>H', array[offset:offset+2])[0]
-        if val >= 0x8000:
-            val -= 0x10000
-        return val
+        return _BE_INT16.unpack_from(array, offset)[0]
     
     @staticmethod
     def get_be_uint16(array, offset):
         """從位元組陣列中讀取大端序16位無符號整數"""
-        return struct.unpack('>H', array[offset:offset+2])[0]
+        return _BE_UINT16.unpack_from(array, offset)[0]
     
     @staticmethod
     def set_be_uint16(array, offset, data):
@@ -32,20 +61,49 @@ class Util:
     @staticmethod
     def get_le_int32(array, offset):
         """從位元組陣列中讀取小端序32位整數（低位在前，高位在後）"""
-        return array[offset] + (array[offset+1] << 8) + (array[offset+2] << 16) + (array[offset+3] << 24)
+        return _LE_UINT32.unpack_from(array, offset)[0]
     
     @staticmethod
     def get_le_int16(array, offset):
         """從位元組陣列中讀取小端序16位整數（低位在前，高位在後）"""
-        val = array[offset] + (array[offset+1] << 8)
-        if val >= 0x8000:
-            val -= 0x10000
-        return val
+        return _LE_INT16.unpack_from(array, offset)[0]
     
     @staticmethod
     def get_le_uint16(array, offset):
         """從位元組陣列中讀取小端序16位無符號整數（低位在前，高位在後）"""
-        return array[offset] + (array[offset+1] << 8)
+        return _LE_UINT16.unpack_from(array, offset)[0]
+    
+    @staticmethod
+    def get_le_ints(array, offset, count, size=2, signed=True):
+        """從位元組陣列中一次讀取count個小端序整數（每個size字節），返回tuple"""
+        return Util._get_ints('<', array, offset, count, size, signed)
+    
+    @staticmethod
+    def get_be_ints(array, offset, count, size=2, signed=True):
+        """從位元組陣列中一次讀取count個大端序整數（每個size字節），返回tuple"""
+        return Util._get_ints('>', array, offset, count, size, signed)
+    
+    @staticmethod
+    def _get_ints(byte_order, array, offset, count, size, signed):
+        """以預先編譯的struct格式一次讀取多個整數"""
+        code = Util._INT_CODES.get((size, signed))
+        if code is None:
+            raise ValueError(f"不支援的整數寬度: {size}")
+        return Util.get_struct(f"{byte_order}{count}{code}").unpack_from(array, offset)
+    
+    @staticmethod
+    def iter_records(array, offset, fmt, count=None):
+        """以struct.iter_unpack逐一讀取固定大小的記錄（count為None時讀到數據結尾的最後一個完整記錄）"""
+        record = Util.get_struct(fmt)
+        available = (len(array) - offset) // record.size if offset < len(array) else 0
+        if count is None or count > available:
+            count = available
+        return record.iter_unpack(memoryview(array)[offset:offset + count * record.size])
+    
+    @staticmethod
+    def get_typed_array(array, offset, count, dtype):
+        """在位元組陣列上建立指定型別（例如'<i2'、'>u4'）的NumPy陣列，不複製數據"""
+        return np.frombuffer(array, dtype=dtype, count=count, offset=offset)
     
     @staticmethod
     def set_le_uint16(array, offset, data):
@@ -69,4 +127,4 @@ class Util:
     @staticmethod
     def conv_bytes_to_hex_string(bytes_data, offset, length):
         """將位元組陣列轉換為十六進制字串"""
-        return ' '.join(f'{b:02x}' for b in bytes_data[offset:offset+length]) 
\ No newline at end of file
+        return ' '.join(f'{b:02x}' for b in bytes_data[offset:offset+length])